@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from random import uniform
+import database as db
+import time
+import os
+
+
+BANK_TIMEZONE = ZoneInfo(os.getenv("BANK_TIMEZONE", "Europe/Stockholm"))
+
+HOURS_PER_WEEK = 7 * 24
+
+
+def enabled() -> bool:
+    return os.getenv("POLL_ADAPTIVE", "1").lower() in ("1", "true", "yes")
+
+
+def parse_time(booking_date: str, sort_key: str) -> tuple:
+    """Return when a stored transaction happened and whether the hour is known.
+
+    Nordea's transactionId, kept as the sort key, starts with a
+    ``YYYY-MM-DD-HH.MM.SS`` timestamp. Other transactions only have a date.
+    """
+    try:
+        return (
+            datetime(
+                int(sort_key[0:4]),
+                int(sort_key[5:7]),
+                int(sort_key[8:10]),
+                int(sort_key[11:13]),
+            ),
+            True,
+        )
+    except (ValueError, TypeError):
+        return datetime.strptime(booking_date[:10], "%Y-%m-%d"), False
+
+
+class ActivityProfile:
+    """Average transactions per hour for each of the 168 hours of a week."""
+
+    def __init__(self, rates: list):
+        self.rates = rates
+
+    @classmethod
+    def from_times(cls, times, now: datetime, history_days: int) -> "ActivityProfile":
+        """Build a profile from ``(datetime, hour_known)`` pairs."""
+        counts = [0.0] * HOURS_PER_WEEK
+        oldest = now
+
+        for when, hour_known in times:
+            oldest = min(oldest, when)
+            day = when.weekday() * 24
+            if hour_known:
+                counts[day + when.hour] += 1
+            else:
+                # Only the date is known, so the transaction counts for the whole day
+                for hour in range(24):
+                    counts[day + hour] += 1 / 24
+
+        # A young account is averaged over the weeks it has existed
+        days = min(history_days, max(7, (now - oldest).days + 1))
+        return cls([count * 7 / days for count in counts])
+
+    def rate(self, when: datetime) -> float:
+        slot = when.weekday() * 24 + when.hour
+        # Activity late in one hour often spills over into the next
+        return (
+            0.5 * self.rates[slot]
+            + 0.25 * self.rates[slot - 1]
+            + 0.25 * self.rates[(slot + 1) % HOURS_PER_WEEK]
+        )
+
+
+class AdaptivePolling:
+    """Chooses each subscriber's next poll interval from their account activity.
+
+    Every hour of the week gets a ceiling from the account's transaction
+    history. An hour averaging ``active_rate`` transactions or more is polled
+    every ``min_interval``, quieter hours get proportionally longer
+    ceilings up to ``max_interval``, and the bank's booking hours on
+    weekdays are capped at ``booking_interval``. Below the ceiling the
+    interval starts at ``min_interval`` after a poll that found something
+    and grows by ``IDLE_GROWTH`` with every empty poll. A long wait is cut
+    short so the next poll lands early in a busier hour ahead.
+    """
+
+    IDLE_GROWTH = 2
+
+    def __init__(self, storage, min_interval: float = None, max_interval: float = None):
+        self.storage = storage
+        self.min_interval = min_interval or float(os.getenv("POLL_INTERVAL_MIN", 60))
+        self.max_interval = max_interval or float(os.getenv("POLL_ADAPTIVE_MAX", 3600))
+        self.active_rate = float(os.getenv("POLL_ACTIVE_RATE", 0.5))
+        self.booking_interval = float(os.getenv("POLL_BOOKING_INTERVAL", 300))
+        self.booking_hours = frozenset(
+            int(hour)
+            for hour in os.getenv("NORDEA_BOOKING_HOURS", "1,6,9,12,15").split(",")
+            if hour.strip()
+        )
+        self.history_days = int(os.getenv("POLL_HISTORY_DAYS", 90))
+        self.profile_ttl = float(os.getenv("POLL_PROFILE_TTL", 6 * 3600))
+
+        self._profiles = {}
+        self._idle = {}
+
+    async def profile(self, account_id: str) -> ActivityProfile:
+        cached = self._profiles.get(account_id)
+        if cached is not None and time.monotonic() - cached[1] < self.profile_ttl:
+            return cached[0]
+
+        now = datetime.now(BANK_TIMEZONE).replace(tzinfo=None)
+        since = (now - timedelta(days=self.history_days)).strftime("%Y-%m-%d")
+        rows = await self.storage.read(db.get_transaction_times, account_id, since)
+        profile = ActivityProfile.from_times(
+            (parse_time(booking_date, sort_key) for booking_date, sort_key in rows),
+            now,
+            self.history_days,
+        )
+        self._profiles[account_id] = (profile, time.monotonic())
+        return profile
+
+    async def next_interval(self, user_id, account_id: str, found: bool) -> float:
+        """Record a poll's outcome and return the seconds until the next one."""
+        if found:
+            self._idle.pop(user_id, None)
+        else:
+            self._idle[user_id] = self._idle.get(user_id, 0) + 1
+
+        return self.interval(
+            await self.profile(account_id),
+            self._idle.get(user_id, 0),
+            datetime.now(BANK_TIMEZONE).replace(tzinfo=None),
+        )
+
+    def forget(self, user_id) -> None:
+        self._idle.pop(user_id, None)
+
+    def ceiling(self, profile: ActivityProfile, when: datetime) -> float:
+        rate = profile.rate(when)
+        ceiling = (
+            self.min_interval * self.active_rate / rate
+            if rate > 0
+            else self.max_interval
+        )
+        if when.weekday() < 5 and when.hour in self.booking_hours:
+            ceiling = min(ceiling, self.booking_interval)
+        return min(max(ceiling, self.min_interval), self.max_interval)
+
+    def interval(self, profile: ActivityProfile, idle: int, now: datetime) -> float:
+        interval = min(
+            self.min_interval * self.IDLE_GROWTH ** min(idle, 32),
+            self.ceiling(profile, now),
+        )
+        # Jitter keeps users with the same history from polling in lockstep
+        interval *= uniform(0.9, 1.1)
+
+        boundary = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        while True:
+            wait = (boundary - now).total_seconds()
+            if wait >= interval:
+                break
+            upcoming = self.ceiling(profile, boundary)
+            if wait + upcoming < interval:
+                # Spread the users waking up for that hour over its interval
+                interval = wait + uniform(0, upcoming)
+                break
+            boundary += timedelta(hours=1)
+
+        return max(interval, self.min_interval)
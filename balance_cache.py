@@ -0,0 +1,72 @@
+from loguru import logger
+import asyncio
+import time
+import os
+
+
+class BalanceCache:
+    """Per-account balance cache with stale-while-revalidate semantics.
+
+    Fresh entries are served as they are. Entries older than the TTL are
+    still served right away while one background task fetches a new value.
+    Only a cold cache waits for the upstream call.
+    """
+
+    def __init__(self, fetch, ttl: float = None):
+        self.fetch = fetch
+        self.ttl = (
+            ttl if ttl is not None else float(os.getenv("BALANCE_CACHE_TTL", 300))
+        )
+        self._entries = {}
+        self._refreshing = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def has(self, account_id: str) -> bool:
+        return account_id in self._entries
+
+    def invalidate(self, account_id: str) -> None:
+        self._entries.pop(account_id, None)
+
+    async def get(self, account_id: str, user_id=None) -> tuple:
+        """Return ``(balance, fetched_at)`` for ``account_id``."""
+        entry = self._entries.get(account_id)
+
+        if entry is None:
+            self.misses += 1
+            return await self._refresh(account_id, user_id)
+
+        if time.time() - entry[1] < self.ttl:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            if account_id not in self._refreshing:
+                task = asyncio.create_task(
+                    self._background_refresh(account_id, user_id)
+                )
+                self._refreshing[account_id] = task
+
+        return entry
+
+    async def _refresh(self, account_id: str, user_id) -> tuple:
+        balance = await self.fetch(account_id, user_id)
+        entry = (balance, time.time())
+        self._entries[account_id] = entry
+        return entry
+
+    async def _background_refresh(self, account_id: str, user_id) -> None:
+        try:
+            await self._refresh(account_id, user_id)
+        except Exception as e:
+            logger.warning(f"Background balance refresh for {account_id} failed: {e}")
+        finally:
+            self._refreshing.pop(account_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,336 @@
+"""Drive BankBot end to end against local GoCardless and Telegram stubs.
+
+Simulated users go through /start, bank login, balance, transactions,
+settings and enabling notifications. The scheduler then polls them for a
+while, and finally the admin broadcasts to everyone. Each user count runs
+in its own process with a fresh database. Run from the repository root:
+
+    python -m benchmarks.bench_bot --users 10,100,1000,10000
+"""
+
+from contextlib import redirect_stdout
+from telegram import Update
+from benchmarks.stubs import GoCardlessStub, TelegramStub
+import argparse
+import threading
+import subprocess
+import tempfile
+import asyncio
+import random
+import time
+import sys
+import os
+
+
+ADMIN_ID = 1
+JOURNEY = [
+    ("start", "/start"),
+    ("login", None),
+    ("balance", "💳 Get Balance"),
+    ("transactions", "📇 Get Transactions"),
+    ("older", "tx:10"),
+    ("settings", "⚙️ Settings"),
+    ("notify_on", "✅ Enable Notifications"),
+]
+
+
+def percentile(values, q) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Stubs:
+    """Runs the stub servers on their own event loop thread.
+
+    Keeping them off the bot's loop means their work does not show up in
+    the loop lag measured for the bot.
+    """
+
+    def __init__(self, *servers):
+        self.servers = servers
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        for server in self.servers:
+            asyncio.run_coroutine_threadsafe(server.start(), self.loop).result()
+
+    def stop(self) -> None:
+        for server in self.servers:
+            asyncio.run_coroutine_threadsafe(server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class Simulation:
+    def __init__(self, bank, users: int, ramp: float):
+        self.bank = bank
+        self.users = users
+        self.ramp = ramp
+        self.latencies = {}
+        self.lag = []
+        self.errors = 0
+        self._update_id = 0
+
+    def update(self, user_id: int, text: str = None) -> Update:
+        self._update_id += 1
+        message = {
+            "message_id": self._update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        }
+        if text is not None and text.startswith("tx:"):
+            # An inline button press on one of the bot's own messages
+            message["from"] = {"id": 1, "is_bot": True, "first_name": "Stub"}
+            callback_query = {
+                "id": str(self._update_id),
+                "from": {
+                    "id": user_id,
+                    "is_bot": False,
+                    "first_name": f"User{user_id}",
+                },
+                "chat_instance": str(user_id),
+                "message": message,
+                "data": text,
+            }
+            return Update.de_json(
+                {"update_id": self._update_id, "callback_query": callback_query},
+                self.bank.application.bot,
+            )
+
+        if text is None:
+            message["web_app_data"] = {
+                "data": "done",
+                "button_text": "👨‍💻 Authenticate Bank",
+            }
+        else:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [
+                    {"type": "bot_command", "offset": 0, "length": len(text)}
+                ]
+
+        return Update.de_json(
+            {"update_id": self._update_id, "message": message},
+            self.bank.application.bot,
+        )
+
+    async def send(self, step: str, user_id: int, text: str = None) -> None:
+        started = time.perf_counter()
+        await self.bank.application.process_update(self.update(user_id, text))
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def on_error(self, update, context) -> None:
+        self.errors += 1
+
+    async def journey(self, user_id: int, rng: random.Random) -> None:
+        await asyncio.sleep(rng.uniform(0, self.ramp))
+        for step, text in JOURNEY:
+            await self.send(step, user_id, text)
+
+    async def monitor_lag(self, interval: float = 0.05) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.lag.append(loop.time() - started - interval)
+
+
+async def simulate(args, gocardless, telegram) -> dict:
+    # Imported late so DB_PATH and the other settings are already in place
+    from bot import BankBot
+
+    bank = BankBot("1:stub")
+    await asyncio.get_running_loop().run_in_executor(None, bank.setup)
+    application = bank.build_application()
+    await application.initialize()
+    await bank.on_post_init(application)
+
+    sim = Simulation(bank, args.users, args.ramp)
+    application.add_error_handler(sim.on_error)
+    monitor = asyncio.create_task(sim.monitor_lag())
+    report = {}
+
+    try:
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(sim.journey(ADMIN_ID + 1 + i, rng) for i in range(args.users))
+        )
+        report["journeys"] = time.perf_counter() - started
+
+        polls_before = bank.scheduler.polls
+        await asyncio.sleep(args.poll_seconds)
+        report["polls"] = bank.scheduler.polls - polls_before
+        report["scheduler"] = bank.scheduler.stats()
+
+        sent_before = bank.broadcaster.sent_total + bank.broadcaster.failed_total
+        started = time.perf_counter()
+        await sim.send("broadcast", ADMIN_ID, "🔊 Notify Everyone")
+        await sim.send("broadcast", ADMIN_ID, "Benchmark broadcast")
+        while bank.broadcaster.jobs:
+            await asyncio.sleep(0.05)
+        report["broadcast_time"] = time.perf_counter() - started
+        report["broadcast_sent"] = (
+            bank.broadcaster.sent_total + bank.broadcaster.failed_total - sent_before
+        )
+    finally:
+        monitor.cancel()
+        await bank.on_post_stop(application)
+        await bank.on_post_shutdown(application)
+        await application.shutdown()
+
+    report["latencies"] = sim.latencies
+    report["lag"] = sim.lag
+    report["errors"] = sim.errors
+    return report
+
+
+def print_report(args, report, gocardless, telegram) -> None:
+    print(
+        f"\n=== {args.users} users, {args.history} booked transactions, "
+        f"bank latency {args.bank_latency * 1000:.0f} ms, "
+        f"Telegram latency {args.telegram_latency * 1000:.0f} ms ==="
+    )
+    print(f"{'handler':<14} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step, values in report["latencies"].items():
+        print(
+            f"{step:<14} {len(values):>7} {percentile(values, 0.5) * 1000:>9.1f} "
+            f"{percentile(values, 0.99) * 1000:>9.1f} {max(values) * 1000:>9.1f}"
+        )
+
+    print(
+        f"\njourneys done in {report['journeys']:.1f} s, {report['errors']} handler errors"
+    )
+    print(
+        f"polls: {report['polls']} in {args.poll_seconds:.0f} s "
+        f"({report['polls'] / args.poll_seconds:.1f}/s), "
+        f"scheduler lag max {report['scheduler']['max_lag']} s, "
+        f"failures {report['scheduler']['failures']}"
+    )
+    print(
+        f"broadcast: {report['broadcast_sent']} messages in {report['broadcast_time']:.1f} s "
+        f"({report['broadcast_sent'] / report['broadcast_time']:.1f} msg/s)"
+    )
+    lag = report["lag"]
+    print(
+        f"loop lag: p50 {percentile(lag, 0.5) * 1000:.1f} ms, "
+        f"p99 {percentile(lag, 0.99) * 1000:.1f} ms, max {max(lag, default=0) * 1000:.1f} ms"
+    )
+    print(
+        f"upstream: {gocardless.requests} GoCardless requests ({gocardless.errors} failed, "
+        f"{gocardless.new_transactions} new transactions), "
+        f"{telegram.requests} Telegram requests {telegram.calls}"
+    )
+
+
+def run(args) -> None:
+    gocardless = GoCardlessStub(
+        history_size=args.history,
+        new_tx_rate=args.new_tx_rate,
+        latency=args.bank_latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    telegram = TelegramStub(latency=args.telegram_latency, seed=args.seed)
+    stubs = Stubs(gocardless, telegram)
+    stubs.start()
+
+    workdir = tempfile.mkdtemp(prefix="bankbot-bench-")
+    os.environ.update(
+        {
+            "GOCARDLESS_BASE_URL": f"{gocardless.url}/api/v2",
+            "TELEGRAM_BASE_URL": f"{telegram.url}/bot",
+            "DB_PATH": os.path.join(workdir, "bench.db"),
+            "SECRET_ID": "stub",
+            "SECRET_KEY": "stub",
+            "ADMIN_ID": str(ADMIN_ID),
+            "WEB_APP_URL": "https://stub.invalid/done",
+            "POLL_INTERVAL_MIN": str(args.poll_interval[0]),
+            "POLL_INTERVAL_MAX": str(args.poll_interval[1]),
+            # Fixed intervals keep the polling phase a throughput test
+            "POLL_ADAPTIVE": "0",
+            "TELEGRAM_RATE": str(args.telegram_rate),
+        }
+    )
+
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    try:
+        # The database module prints every update, which would flood the report
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            report = asyncio.run(simulate(args, gocardless, telegram))
+    finally:
+        stubs.stop()
+
+    print_report(args, report, gocardless, telegram)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--users", default="10,100,1000", help="comma separated user counts"
+    )
+    parser.add_argument(
+        "--history", type=int, default=500, help="booked transactions per account"
+    )
+    parser.add_argument("--bank-latency", type=float, default=0.08, help="seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="seconds")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of failed bank requests"
+    )
+    parser.add_argument(
+        "--new-tx-rate",
+        type=float,
+        default=0.05,
+        help="chance a poll finds a new transaction",
+    )
+    parser.add_argument(
+        "--ramp", type=float, default=5.0, help="seconds over which users arrive"
+    )
+    parser.add_argument(
+        "--poll-seconds", type=float, default=20.0, help="length of the polling phase"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        nargs=2,
+        default=(5.0, 10.0),
+        help="min and max poll interval",
+    )
+    parser.add_argument(
+        "--telegram-rate",
+        type=float,
+        default=1000.0,
+        help="global Bot API messages per second",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.users.split(",")]
+    if len(sizes) == 1:
+        args.users = sizes[0]
+        run(args)
+        return
+
+    # A process per size keeps databases, caches and module state apart
+    for size in sizes:
+        argv = [arg for arg in sys.argv[1:]]
+        if "--users" in argv:
+            index = argv.index("--users")
+            del argv[index : index + 2]
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_bot", *argv, "--users", str(size)],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
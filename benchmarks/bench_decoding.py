@@ -0,0 +1,49 @@
+"""Compare full stdlib decoding of a /transactions/ response with ``decoding``.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_decoding
+"""
+
+from benchmarks.payloads import history
+import tracemalloc
+import decoding
+import timeit
+import json
+
+
+def stdlib_decode(body: bytes) -> dict:
+    # What httpx's response.json() does
+    return json.loads(body)["transactions"]
+
+
+def bench(label, func, body, repeat=5):
+    number = max(1, 2000000 // len(body))
+    best = min(timeit.repeat(lambda: func(body), number=number, repeat=repeat))
+
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<16} {best / number * 1e3:9.3f} ms  peak {peak / 1024:9.0f} KiB")
+    return best / number
+
+
+def main():
+    for size in (100, 1000, 10000):
+        body = json.dumps(history(booked=size), ensure_ascii=False).encode("utf-8")
+        print(f"{size} booked transactions, {len(body) / 1024:.0f} KiB")
+
+        baseline = bench("stdlib", stdlib_decode, body)
+        full = bench("decoding", decoding.decode_transactions, body)
+        partial = bench(
+            "decoding[:200]", lambda b: decoding.decode_transactions(b, 200), body
+        )
+        print(
+            f"{'':<16} speedup x{baseline / full:.2f} full, x{baseline / partial:.2f} partial\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compare the transaction formatter with the implementation it replaced.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_formatter
+"""
+
+from datetime import datetime
+from benchmarks.payloads import history
+import tx_formatter
+import timeit
+
+
+def legacy_format_transaction(tx_dict: dict) -> tuple:
+    # Verbatim copy of the former BankBot.format_transaction
+    transaction_summ = float(tx_dict["transactionAmount"]["amount"])
+    transaction_amount = f"{transaction_summ} SEK"
+    transaction_type = tx_dict["remittanceInformationUnstructured"].strip("*")
+
+    if transaction_summ < 0:
+        inverted_summ = transaction_summ * -1
+        transaction_amount = f"**{inverted_summ}** SEK"
+
+    if "Överföring" in transaction_type:
+        if transaction_summ < 0:
+            transaction_type = f"🔄 #Transfer  to {transaction_type.strip('Överföring')}"
+        else:
+            transaction_type = (
+                f"🔄 #Transfer  from {transaction_type.strip('Överföring')}"
+            )
+    elif "Kortköp" in transaction_type:
+        transaction_type = (
+            f"💳 #CardPayment  to {transaction_type.strip('Kortköp')[7:]}".replace(
+                "*", ""
+            )
+        )
+    elif "Lön" in transaction_type:
+        transaction_type = "💰 #MonthlySalary"
+    elif "" in transaction_type:
+        transaction_type = (
+            f"🏦 #ServicePayment  to {transaction_type.strip('Betalning')}"
+        )
+
+    transaction_date = datetime.strptime(
+        tx_dict["transactionId"], "%Y-%m-%d-%H.%M.%S.%f"
+    ).strftime("%d.%m.%Y ⌛ %H:%M")
+    data_message = f"{transaction_type}\n\n💵 Amount: {transaction_amount}\n\n🗓️ Date: {transaction_date}"
+
+    characters_to_escape = [".", "-", "(", ")", "#"]
+    data_message = "".join(
+        ["\\" + char if char in characters_to_escape else char for char in data_message]
+    )
+
+    return data_message, datetime.strptime(
+        tx_dict["transactionId"], "%Y-%m-%d-%H.%M.%S.%f"
+    )
+
+
+def legacy_format_batch(transactions) -> list:
+    formatted = sorted(
+        (legacy_format_transaction(tx) for tx in transactions), key=lambda item: item[1]
+    )
+    return [message for message, _ in formatted]
+
+
+def bench(label, func, transactions, repeat=5):
+    number = max(1, 20000 // len(transactions))
+    best = min(timeit.repeat(lambda: func(transactions), number=number, repeat=repeat))
+    per_tx = best / number / len(transactions) * 1e6
+    print(f"{label:<10} {len(transactions):>6} txs  {per_tx:8.2f} µs/tx")
+    return per_tx
+
+
+def main():
+    for size in (10, 50, 500):
+        payload = history(booked=size, pending=0)["transactions"]["booked"]
+        legacy = bench("legacy", legacy_format_batch, payload)
+        current = bench("current", tx_formatter.format_batch, payload)
+        print(f"{'':<10} speedup x{legacy / current:.2f}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Compare fixed and adaptive poll intervals on simulated account activity.
+
+Each simulated user gets 90 days of history to learn from and two weeks of
+new transactions. Polls run in virtual time, and a transaction counts as
+notified at the first poll after it happened. Run from the repository root:
+
+    python -m benchmarks.bench_polling
+"""
+
+from datetime import datetime, timedelta
+from activity import ActivityProfile, AdaptivePolling
+import argparse
+import random
+
+
+START = datetime(2023, 11, 13)
+HISTORY_DAYS = 90
+SIMULATED_DAYS = 14
+
+
+def card_user(rng, day: datetime) -> list:
+    """Several card payments spread over waking hours, more at weekends."""
+    count = rng.randint(3, 8) if day.weekday() < 5 else rng.randint(5, 12)
+    return [
+        day + timedelta(hours=rng.triangular(7, 23, 17), minutes=rng.uniform(0, 59))
+        for _ in range(count)
+    ]
+
+
+def commuter(rng, day: datetime) -> list:
+    """Coffee before work and groceries after, on weekdays only."""
+    if day.weekday() >= 5:
+        return []
+    return [
+        day + timedelta(hours=rng.gauss(8, 0.4)),
+        day + timedelta(hours=rng.gauss(17.5, 0.7)),
+    ]
+
+
+def salary_only(rng, day: datetime) -> list:
+    """A monthly salary booked in the early morning run, nothing else.
+
+    It is paid on the 25th, or on the Friday before when that is a weekend.
+    """
+    payday = day.replace(day=25)
+    while payday.weekday() >= 5:
+        payday -= timedelta(days=1)
+    if day != payday:
+        return []
+    return [day + timedelta(hours=6, minutes=rng.uniform(0, 20))]
+
+
+USERS = {"card": card_user, "commuter": commuter, "salary": salary_only}
+
+
+def activity(kind: str, rng, start: datetime, days: int) -> list:
+    return sorted(
+        when
+        for offset in range(days)
+        for when in USERS[kind](rng, start + timedelta(days=offset))
+    )
+
+
+def simulate(events: list, next_interval) -> tuple:
+    """Poll over the simulated period and return (polls, notification delays)."""
+    end = START + timedelta(days=SIMULATED_DAYS)
+    now = START + timedelta(seconds=next_interval(START, False))
+    polls = 0
+    delays = []
+    pending = 0
+
+    while now < end:
+        polls += 1
+        found = False
+        while pending < len(events) and events[pending] <= now:
+            delays.append((now - events[pending]).total_seconds())
+            pending += 1
+            found = True
+        now += timedelta(seconds=next_interval(now, found))
+
+    return polls, delays
+
+
+def percentile(values, q) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(label, polls, delays) -> None:
+    mean = sum(delays) / len(delays) if delays else 0.0
+    print(
+        f"{label:<10} {polls / SIMULATED_DAYS:8.0f} {mean:9.0f} "
+        f"{percentile(delays, 0.5):9.0f} {percentile(delays, 0.95):9.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--min-interval", type=float, default=60)
+    parser.add_argument(
+        "--max-interval", type=float, default=120, help="of the fixed schedule"
+    )
+    parser.add_argument("--adaptive-max", type=float, default=3600)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    polling = AdaptivePolling(None, args.min_interval, args.adaptive_max)
+
+    for kind in USERS:
+        rng = random.Random(args.seed)
+        history = activity(
+            kind, rng, START - timedelta(days=HISTORY_DAYS), HISTORY_DAYS
+        )
+        events = activity(kind, rng, START, SIMULATED_DAYS)
+        profile = ActivityProfile.from_times(
+            ((when, True) for when in history), START, HISTORY_DAYS
+        )
+
+        def fixed(now, found):
+            return rng.uniform(args.min_interval, args.max_interval)
+
+        idle = [0]
+
+        def adaptive(now, found):
+            idle[0] = 0 if found else idle[0] + 1
+            return polling.interval(profile, idle[0], now)
+
+        print(f"{kind}: {len(events)} transactions in {SIMULATED_DAYS} days")
+        print(
+            f"{'schedule':<10} {'polls/day':>8} {'mean s':>9} {'p50 s':>9} {'p95 s':>9}"
+        )
+        report("fixed", *simulate(events, fixed))
+        report("adaptive", *simulate(events, adaptive))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Synthetic GoCardless transaction payloads shaped like Nordea SE data."""
+
+from datetime import datetime, timedelta
+import random
+
+PAYEES = [
+    "ICA NARA SOLNA",
+    "COOP KONSUM (ODENPLAN)",
+    "SL-ACCESS",
+    "SPOTIFY AB",
+    "SYSTEMBOLAGET 0112",
+    "WILLYS HEMMA.SE",
+    "MAX HAMBURGARE T-CENTRALEN",
+    "APOTEK HJARTAT!",
+]
+
+
+def transaction(when: datetime, rng: random.Random, pending: bool = False) -> dict:
+    kind = rng.random()
+
+    if kind < 0.65:
+        remittance = f"Kortköp {when:%y%m%d} {rng.choice(PAYEES)}"
+        amount = -round(rng.uniform(15, 900), 2)
+    elif kind < 0.85:
+        remittance = f"Överföring {rng.randint(1000, 9999)}-{rng.randint(100000, 999999)} Anna Svensson"
+        amount = round(rng.uniform(-3000, 3000), 2)
+    elif kind < 0.9:
+        remittance = "Lön"
+        amount = 31250.0
+    else:
+        remittance = f"Betalning BG {rng.randint(100, 999)}-{rng.randint(1000, 9999)} Telia Sverige"
+        amount = -round(rng.uniform(99, 1200), 2)
+
+    tx = {
+        "transactionId": when.strftime("%Y-%m-%d-%H.%M.%S.%f"),
+        "transactionAmount": {"amount": f"{amount:.2f}", "currency": "SEK"},
+        "remittanceInformationUnstructured": remittance,
+        "valueDate": f"{when:%Y-%m-%d}",
+    }
+    if not pending:
+        tx["bookingDate"] = f"{when:%Y-%m-%d}"
+    return tx
+
+
+def history(booked: int, pending: int = 3, seed: int = 1) -> dict:
+    """Return a /transactions/ response body with the newest entries first."""
+    rng = random.Random(seed)
+    now = datetime(2023, 11, 20, 18, 0, 0)
+
+    pending_txs = [
+        transaction(now - timedelta(minutes=17 * i), rng, pending=True)
+        for i in range(pending)
+    ]
+    booked_txs = [
+        transaction(now - timedelta(days=1, minutes=211 * i, microseconds=i), rng)
+        for i in range(booked)
+    ]
+    return {"transactions": {"booked": booked_txs, "pending": pending_txs}}
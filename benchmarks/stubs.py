@@ -0,0 +1,251 @@
+"""Local stand-ins for the GoCardless Bank Account Data and Telegram Bot APIs.
+
+Both are small asyncio HTTP/1.1 servers with keep-alive, so the bot's real
+HTTP clients can talk to them unchanged through ``GOCARDLESS_BASE_URL`` and
+``TELEGRAM_BASE_URL``. Every response is delayed by a random latency around
+``latency`` seconds, and ``error_rate`` of the requests fail with a 500.
+"""
+
+from urllib.parse import parse_qs, urlsplit
+from datetime import datetime
+from benchmarks.payloads import history, transaction
+import asyncio
+import random
+import json
+import time
+
+
+REASONS = {200: "OK", 201: "Created", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class StubServer:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.port = None
+        self._server = None
+        self._connections = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._serve, "127.0.0.1", 0, backlog=4096
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def handle(self, method: str, path: str, query: dict, body: bytes) -> tuple:
+        """Return ``(status, payload)`` for a request, payload as JSON-able or bytes."""
+        raise NotImplementedError
+
+    async def _serve(self, reader, writer) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                lines = head.decode("latin-1").split("\r\n")
+                method, target, _ = lines[0].split(" ", 2)
+                headers = {
+                    name.strip().lower(): value.strip()
+                    for name, value in (
+                        line.split(":", 1) for line in lines[1:] if ":" in line
+                    )
+                }
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                url = urlsplit(target)
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+
+                if self.error_rate and self.rng.random() < self.error_rate:
+                    self.errors += 1
+                    status, payload = 500, {"detail": "Stub failure"}
+                else:
+                    status, payload = await self.handle(
+                        method, url.path, parse_qs(url.query), body
+                    )
+
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(payload)}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+class GoCardlessStub(StubServer):
+    """Serves tokens, sessions and account data for any number of accounts.
+
+    Every account shares one booked history of ``history_size`` entries.
+    Each transactions request books a new transaction on that account with
+    probability ``new_tx_rate``, which the bot should report as a
+    notification.
+    """
+
+    def __init__(self, history_size: int = 500, new_tx_rate: float = 0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.new_tx_rate = new_tx_rate
+        self.new_transactions = 0
+
+        payload = history(booked=history_size)["transactions"]
+        # Pre-encoded once and sliced per request, newest first
+        self._booked = [
+            (tx["bookingDate"], json.dumps(tx, ensure_ascii=False).encode("utf-8"))
+            for tx in payload["booked"]
+        ]
+        self._pending = json.dumps(payload["pending"], ensure_ascii=False).encode(
+            "utf-8"
+        )
+        self._extra = {}
+        self._requisitions = 0
+
+    async def handle(self, method, path, query, body):
+        parts = [part for part in path.split("/") if part][2:]  # Drop /api/v2
+
+        if parts[:1] == ["token"]:
+            return 200, {
+                "access": f"access-{time.monotonic_ns()}",
+                "refresh": "refresh",
+                "access_expires": 86400,
+                "refresh_expires": 2592000,
+            }
+        if parts == ["institutions"]:
+            return 200, [{"id": "NORDEA_NDEASESS", "name": "Nordea Personal"}]
+        if parts == ["agreements", "enduser"]:
+            return 201, {"id": f"agreement-{time.monotonic_ns()}"}
+        if parts == ["requisitions"]:
+            self._requisitions += 1
+            requisition_id = f"req-{self._requisitions}"
+            return 201, {
+                "id": requisition_id,
+                "link": f"https://stub.invalid/auth/{requisition_id}",
+            }
+        if parts[:1] == ["requisitions"]:
+            return 200, {
+                "id": parts[1],
+                "status": "LN",
+                "accounts": [f"acc-{parts[1]}"],
+            }
+
+        if parts[:1] == ["accounts"] and len(parts) == 3:
+            account_id, endpoint = parts[1], parts[2]
+            if endpoint == "balances":
+                return 200, {
+                    "balances": [
+                        {
+                            "balanceAmount": {"amount": "12345.67", "currency": "SEK"},
+                            "balanceType": "interimAvailable",
+                        }
+                    ]
+                }
+            if endpoint == "details":
+                return 200, {
+                    "account": {"ownerName": "Anna Svensson", "product": "Personkonto"}
+                }
+            if endpoint == "transactions":
+                return 200, self._transactions(
+                    account_id, query.get("date_from", [None])[0]
+                )
+
+        return 404, {"detail": "Not found"}
+
+    def _transactions(self, account_id: str, date_from: str) -> bytes:
+        extra = self._extra.setdefault(account_id, [])
+        if self.rng.random() < self.new_tx_rate:
+            now = datetime.now()
+            extra.insert(
+                0,
+                (
+                    f"{now:%Y-%m-%d}",
+                    json.dumps(transaction(now, self.rng), ensure_ascii=False).encode(
+                        "utf-8"
+                    ),
+                ),
+            )
+            self.new_transactions += 1
+
+        booked = []
+        for booking_date, encoded in extra + self._booked:
+            if date_from and booking_date < date_from:
+                break
+            booked.append(encoded)
+
+        return (
+            b'{"transactions":{"booked":['
+            + b",".join(booked)
+            + b'],"pending":'
+            + self._pending
+            + b"}}"
+        )
+
+
+class TelegramStub(StubServer):
+    """Answers the Bot API methods the bot calls and counts them."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = {}
+        self._message_id = 0
+
+    async def handle(self, method, path, query, body):
+        api_method = path.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+        if api_method == "getMe":
+            result = {
+                "id": 1,
+                "is_bot": True,
+                "first_name": "Stub",
+                "username": "stub_bot",
+                "can_join_groups": False,
+                "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        elif api_method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            result = {
+                "message_id": int(params.get("message_id", self._message_id)),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        elif api_method == "getUpdates":
+            result = []
+        else:
+            result = True
+
+        return 200, {"ok": True, "result": result}
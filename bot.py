@@ -1,4 +1,11 @@
-from telegram import Update, KeyboardButton, WebAppInfo, ReplyKeyboardMarkup
+from telegram import (
+    Update,
+    KeyboardButton,
+    WebAppInfo,
+    ReplyKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+)
 from telegram.ext import (
     CommandHandler,
     MessageHandler,
@@ -12,11 +19,31 @@ from nordigen import NordigenClient
 from dotenv import load_dotenv
 from datetime import datetime
 from functools import wraps
-from random import randint
 from loguru import logger
 from uuid import uuid4
+from gocardless import GoCardlessClient
+from sdk_pool import SdkPool
+from token_manager import TokenManager
+from scheduler import PollScheduler
+from quota import QuotaBudget, QuotaExceeded
+from balance_cache import BalanceCache
+from singleflight import SingleFlight
+from storage import Storage
+from broadcast import Broadcaster
+from metrics import HANDLER_SECONDS, REGISTRY, MeteredRequest, MetricsServer
+from diagnostics import LoopMonitor, SamplingProfiler
+from update_processor import UserOrderedUpdateProcessor
+from outbound import OutboundDispatcher, NOTIFICATION
+from activity import AdaptivePolling
+import activity
+import diagnostics
+import tx_formatter
+import decoding
 import database as db
 import requests
+import secrets
+import httpx
+import time
 import os
 
 
@@ -25,12 +52,34 @@ load_dotenv()
 
 class BankBot:
     AWAITING_MESSAGE = 0
+    SEEN_WINDOW = 50
+    COLD_SYNC_LIMIT = int(os.getenv("TX_COLD_SYNC_LIMIT", 200))
+    SYNC_FRESHNESS = float(os.getenv("TX_SYNC_FRESHNESS", 10))
+    TX_PAGE_SIZE = int(os.getenv("TX_PAGE_SIZE", 10))
+    INSTITUTION_CACHE_TTL = float(os.getenv("INSTITUTION_CACHE_TTL", 7 * 24 * 3600))
+    TOKEN_CACHE_KEY = "gocardless_token"
+    INSTITUTION_CACHE_KEY = "institution:SE:Nordea Personal"
 
     def __init__(self, bot_token):
         self.bot_token = bot_token
+        # With POLL_MODE=workers, worker.py processes poll and notify instead
+        self.poll_locally = os.getenv("POLL_MODE", "local") != "workers"
         self.application = None
         self.client = None
-        self.init_token = None
+        self.sdk = None
+        self.tokens = None
+        self.api = GoCardlessClient()
+        self.scheduler = None
+        self.storage = Storage()
+        self.polling = AdaptivePolling(self.storage) if activity.enabled() else None
+        self.quota = QuotaBudget(storage=self.storage)
+        self.balances = BalanceCache(self.fetch_balance)
+        self.flights = SingleFlight()
+        self._synced_at = {}
+        self.broadcaster = None
+        self.metrics = MetricsServer()
+        self.monitor = LoopMonitor()
+        self.profiler = SamplingProfiler()
 
     @staticmethod
     def log_info(func):
@@ -39,38 +88,60 @@ class BankBot:
             self, update: Update, context: CallbackContext, *args, **kwargs
         ):
             logger.info(
-                f"User {update.message.from_user.id} wrote {func.__name__} at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+                f"User {update.effective_user.id} wrote {func.__name__} at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
             )
-            result = await func(self, update, context, *args, **kwargs)
+            with HANDLER_SECONDS.time(func.__name__):
+                result = await func(self, update, context, *args, **kwargs)
             return result
 
         return wrapper
 
-    async def refresh_token(self) -> None:
-        logger.warning("Tokens are expired, getting new tokens...")
-        self.init_token = self.client.generate_token()
+    async def api_get(
+        self, endpoint: str, account_id: str, user_id=None, interactive=True, **kwargs
+    ):
+        await self.quota.load(account_id, endpoint)
+        self.quota.check(account_id, endpoint, interactive)
+
+        request = getattr(self.api, f"get_{endpoint}")
+        access_token = await self.tokens.access()
+        response = await request(account_id, access_token, **kwargs)
+
+        if response.status_code == 401:
+            logger.error(
+                f"User {user_id} tried to make a request but request was unsuccessful.\nRequest failed with code {response.status_code} and message {response.text}"
+            )
+            access_token = await self.tokens.refresh(stale=access_token)
+            response = await request(account_id, access_token, **kwargs)
+
+        self.quota.record(account_id, endpoint, response, interactive)
+
+        if response.status_code == 429:
+            raise QuotaExceeded(
+                account_id, endpoint, self.quota.next_poll_at(account_id, endpoint)
+            )
+
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def quota_message(error: QuotaExceeded) -> str:
+        return f"⏳ Bank request limit reached, please try again after {datetime.fromtimestamp(error.retry_at).strftime('%d.%m.%Y %H:%M')}"
 
     @log_info
     async def on_start(self, update: Update, callback: CallbackContext) -> None:
         user_id = update.message.from_user.id
+        user = await self.storage.get_user(user_id)
 
-        if db.user_exists(user_id):
-            if db.is_authorized(user_id):
+        if user is not None:
+            if user.is_authorized:
                 try:
-                    await self.authenticated(update, callback)
-                    if db.get_tx_notify(user_id)[0]:
-                        self.remove_job_if_exists(f"tx_checker_{user_id}", callback)
-                        callback.job_queue.run_repeating(
-                            self.new_tx_trigger,
-                            randint(60, 120),
-                            chat_id=user_id,
-                            name=f"tx_checker_{user_id}",
-                            data=callback,
-                        )
+                    await self.authenticated(update, callback, user)
+                    if user.tx_notify and user_id not in self.scheduler:
+                        self.scheduler.add(user_id)
                     return
                 except requests.HTTPError:
-                    await self.refresh_token()
-                    await self.authenticated(update, callback)
+                    await self.tokens.refresh()
+                    await self.authenticated(update, callback, user)
                     return
 
             login_keyboard = [
@@ -89,7 +160,7 @@ class BankBot:
             return
 
         else:
-            db.insert_user(user_id)
+            self.storage.write(db.insert_user, user_id)
 
             await update.message.reply_text(
                 f"👨 Hello {update.message.from_user.first_name}! Welcome to Nordea Bank Checker, please authenticate in your bank."
@@ -97,7 +168,7 @@ class BankBot:
             try:
                 await self.bank_init(update, callback)
             except requests.HTTPError:
-                await self.refresh_token()
+                await self.tokens.refresh()
                 await self.bank_init(update, callback)
             return
 
@@ -107,17 +178,21 @@ class BankBot:
 
         user_id = update.message.from_user.id
 
-        init = self.client.initialize_session(
+        await self.tokens.access()
+        init = await self.sdk.initialize_session(
             institution_id=self.institution_id,
             redirect_uri=os.getenv("WEB_APP_URL"),
             reference_id=str(uuid4()),
         )
 
         auth_link = init.link
-        requisition_id = init.requisition_id
 
-        db.insert_auth_link(user_id, auth_link)
-        db.insert_requisition_id(user_id, requisition_id)
+        await self.storage.write(
+            db.update_user,
+            user_id,
+            auth_link=auth_link,
+            requisition_id=init.requisition_id,
+        )
 
         keyboard = [
             [
@@ -134,28 +209,40 @@ class BankBot:
         )
 
     @log_info
-    async def authenticated(self, update: Update, context: CallbackContext) -> None:
+    async def authenticated(
+        self, update: Update, context: CallbackContext, user: db.UserRecord = None
+    ) -> None:
         user_id = update.message.from_user.id
+        user = user or await self.storage.get_user(user_id)
 
-        account_id = self.client.requisition.get_requisition_by_id(
-            requisition_id=db.get_requisition_id(user_id)
-        )["accounts"][0]
-
-        db.insert_account_id(user_id, account_id)
+        await self.tokens.access()
+        requisition = await self.sdk.get_requisition_by_id(
+            requisition_id=user.requisition_id
+        )
+        account_id = requisition["accounts"][0]
 
-        if not db.is_authorized(user_id):
-            db.insert_is_authorized(user_id, 1)
+        if account_id != user.bank_account_id or not user.is_authorized:
+            await self.storage.write(
+                db.update_user, user_id, bank_account_id=account_id, is_authorized=True
+            )
 
         await update.message.reply_text("✅ Authentication Successful! ✅")
         await update.message.reply_text("♻️ Getting Account details...")
 
-        account = self.client.account_api(id=db.get_account_id(user_id))
-
-        account_details = account.get_details()
+        try:
+            response = await self.api_get("details", account_id, user_id)
+            account_details = decoding.loads(response.content)
 
-        await update.message.reply_text(
-            f"✅ Account Connected! ✅\nWelcome!\n\n🙎‍♂️ Account Owner: {account_details['account']['ownerName']}\n💳Account Name: {account_details['account']['product']} "
-        )
+            await update.message.reply_text(
+                f"✅ Account Connected! ✅\nWelcome!\n\n🙎‍♂️ Account Owner: {account_details['account']['ownerName']}\n💳Account Name: {account_details['account']['product']} "
+            )
+        except QuotaExceeded:
+            await update.message.reply_text("✅ Account Connected! ✅\nWelcome!")
+        except httpx.HTTPStatusError:
+            await update.message.reply_text(
+                "⚠️ The bank did not return your account details, please /start again later."
+            )
+            return
 
         main_keyboard = [
             [
@@ -185,158 +272,199 @@ class BankBot:
 
     @log_info
     async def get_balance(self, update: Update, context: CallbackContext) -> None:
-        await update.message.reply_text("♻️ Getting balance...")
+        # A user's updates are handled in order, so repeated taps never overlap
+        await self.send_balance(update)
 
-        url = f"https://bankaccountdata.gocardless.com/api/v2/accounts/{db.get_account_id(update.message.from_user.id)}/balances/"
+    async def send_balance(self, update: Update) -> None:
+        user_id = update.message.from_user.id
+        account_id = (await self.storage.get_user(user_id)).bank_account_id
 
-        response = requests.get(
-            url,
-            headers={
-                "accept": "application/json",
-                "Authorization": f"Bearer {self.init_token['access']}",
-            },
-        )
-        if response.status_code == 401:
-            logger.error(
-                f"User {update.message.from_user.id} tried to make a request but request was unsuccessful.\nRequest failed with code {response.status_code} and message {response.text}"
-            )
-            await self.refresh_token()
-            response = requests.get(
-                url,
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {self.init_token['access']}",
-                },
+        if not self.balances.has(account_id):
+            await update.message.reply_text("♻️ Getting balance...")
+
+        try:
+            balance, fetched_at = await self.balances.get(account_id, user_id)
+        except QuotaExceeded as e:
+            await update.message.reply_text(self.quota_message(e))
+            return
+        except httpx.HTTPStatusError:
+            await update.message.reply_text(
+                "⚠️ The bank did not return your balance, please try again later."
             )
+            return
+
+        await update.message.reply_text(
+            f"💸 Account Balance is {balance} SEK\n🕒 As of {datetime.fromtimestamp(fetched_at).strftime('%d.%m.%Y %H:%M')}",
+        )
+
+    async def fetch_balance(self, account_id: str, user_id=None) -> str:
+        return await self.flights.do(
+            f"{account_id}:balances", self.request_balance, account_id, user_id
+        )
+
+    async def request_balance(self, account_id: str, user_id=None) -> str:
+        response = await self.api_get("balances", account_id, user_id)
 
-        balance = next(
+        return next(
             (
                 balance["balanceAmount"]["amount"]
-                for balance in response.json().get("balances", [])
+                for balance in decoding.loads(response.content).get("balances", [])
                 if balance.get("balanceType") == "interimAvailable"
             ),
             None,
         )
 
-        await update.message.reply_text(
-            f"💸 Account Balance is {balance} SEK",
+    async def sync_transactions(
+        self, account_id: str, user_id=None, interactive=True
+    ) -> None:
+        # Taps queued behind each other reuse a sync that has just finished
+        synced_at = self._synced_at.get(account_id)
+        if synced_at is not None and time.monotonic() - synced_at < self.SYNC_FRESHNESS:
+            return
+
+        # A poll and a manual fetch of the same account share one upstream call
+        await self.flights.do(
+            f"{account_id}:transactions",
+            self.pull_transactions,
+            account_id,
+            user_id,
+            interactive,
         )
 
-    async def get_transactions_logic(self, user_id) -> str:
-        url = f"https://bankaccountdata.gocardless.com/api/v2/accounts/{db.get_account_id(user_id)}/transactions/"
+    async def pull_transactions(
+        self, account_id: str, user_id=None, interactive=True
+    ) -> None:
+        """Pull transactions booked since the newest stored one into the local store."""
+        date_from = await self.storage.read(db.get_latest_booking_date, account_id)
+        params = {"date_from": date_from} if date_from else None
 
-        response = requests.get(
-            url,
-            headers={
-                "accept": "application/json",
-                "Authorization": f"Bearer {self.init_token['access']}",
-            },
+        response = await self.api_get(
+            "transactions", account_id, user_id, interactive, params=params
+        )
+        # A cold sync only needs the recent end of a possibly years-long history
+        transactions = decoding.decode_transactions(
+            response.content, None if date_from else self.COLD_SYNC_LIMIT
         )
 
-        if response.status_code == 401:
-            logger.error(
-                f"User {user_id} tried to make a request but request was unsuccessful.\nRequest failed with code {response.status_code} and message {response.text}"
-            )
-            await self.refresh_token()
-            response = requests.get(
-                url,
-                headers={
-                    "accept": "application/json",
-                    "Authorization": f"Bearer {self.init_token['access']}",
-                },
-            )
-
-        return response
+        await self.storage.write(
+            db.store_transactions,
+            account_id,
+            [
+                self.transaction_row(tx, status)
+                for status in ("booked", "pending")
+                for tx in transactions.get(status, [])
+            ],
+        )
+        self._synced_at[account_id] = time.monotonic()
 
-    def format_transactons(self, response: str) -> list:
-        def format_message(tx_dict: dict) -> None:
-            transaction_summ = float(tx_dict["transactionAmount"]["amount"])
-            transaction_amount = f"{transaction_summ} SEK"
-            transaction_type = tx_dict["remittanceInformationUnstructured"].strip("*")
+    def transaction_row(self, tx_dict: dict, status: str) -> tuple:
+        tx_id = self.transaction_id(tx_dict)
+        booking_date = (
+            tx_dict.get("bookingDate") or tx_dict.get("valueDate") or tx_id[:10]
+        )
+        return (
+            tx_id,
+            status,
+            booking_date,
+            tx_dict.get("transactionId") or booking_date,
+            decoding.dumps(tx_dict),
+        )
 
-            if transaction_summ < 0:
-                inverted_summ = transaction_summ * -1
-                transaction_amount = f"**{inverted_summ}** SEK"
+    @staticmethod
+    def transaction_id(tx_dict: dict) -> str:
+        return (
+            tx_dict.get("transactionId")
+            or tx_dict.get("internalTransactionId")
+            or f"{tx_dict.get('bookingDate')}:{tx_dict['transactionAmount']['amount']}:{tx_dict.get('remittanceInformationUnstructured')}"
+        )
 
-            if "Överföring" in transaction_type:
-                if transaction_summ < 0:
-                    transaction_type = (
-                        f"🔄 #Transfer  to {transaction_type.strip('Överföring')}"
-                    )
-                else:
-                    transaction_type = (
-                        f"🔄 #Transfer  from {transaction_type.strip('Överföring')}"
-                    )
-            elif "Kortköp" in transaction_type:
-                transaction_type = f"💳 #CardPayment  to {transaction_type.strip('Kortköp')[7:]}".replace(
-                    "*", ""
-                )
-            elif "Lön" in transaction_type:
-                transaction_type = "💰 #MonthlySalary"
-            elif "" in transaction_type:
-                transaction_type = (
-                    f"🏦 #ServicePayment  to {transaction_type.strip('Betalning')}"
-                )
+    @log_info
+    async def get_transactions(self, update: Update, context: CallbackContext) -> None:
+        logger.info(
+            f"User {update.message.from_user.id} pressed Get Transactions at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        )
+        await self.send_transactions(update)
 
-            transaction_date = datetime.strptime(
-                tx_dict["transactionId"], "%Y-%m-%d-%H.%M.%S.%f"
-            ).strftime("%d.%m.%Y ⌛ %H:%M")
-            data_message = f"{transaction_type}\n\n💵 Amount: {transaction_amount}\n\n🗓️ Date: {transaction_date}"
+    async def send_transactions(self, update: Update) -> None:
+        await update.message.reply_text("♻️ Getting transactions...")
 
-            characters_to_escape = [".", "-", "(", ")", "#"]
-            data_message = "".join(
-                [
-                    "\\" + char if char in characters_to_escape else char
-                    for char in data_message
-                ]
-            )
+        user_id = update.message.from_user.id
+        account_id = (await self.storage.get_user(user_id)).bank_account_id
 
-            return data_message, datetime.strptime(
-                tx_dict["transactionId"], "%Y-%m-%d-%H.%M.%S.%f"
+        try:
+            await self.sync_transactions(account_id, user_id)
+        except QuotaExceeded as e:
+            await update.message.reply_text(self.quota_message(e))
+        except httpx.HTTPStatusError:
+            await update.message.reply_text(
+                "⚠️ The bank did not return new transactions, showing the stored ones."
             )
 
-        booked_dict = {}
-        pending_dict = {}
-
-        for transaction in response.json()["transactions"]["booked"][:10]:
-            message, date = format_message(transaction)
-            booked_dict[date] = message
+        await self.send_transaction_page(update.message, account_id, 0)
 
-        for transaction in response.json()["transactions"]["pending"]:
-            message, date = format_message(transaction)
-            pending_dict[date] = message
+    async def send_transaction_page(
+        self, message, account_id: str, offset: int
+    ) -> None:
+        """Reply with a page of stored transactions packed into few messages.
 
-        transactions_dict = booked_dict | pending_dict
-        sorted_tx_dict = dict(
-            sorted(transactions_dict.items(), key=lambda item: item[0])
+        One extra transaction is read to tell whether older ones exist. If
+        they do, the last message gets a button that loads the next page.
+        """
+        transactions = await self.storage.read(
+            db.get_recent_transactions, account_id, self.TX_PAGE_SIZE + 1, offset
+        )
+        messages_list = tx_formatter.pack(
+            tx_formatter.format_batch(transactions[: self.TX_PAGE_SIZE])
         )
-        transactions_list = [tx for tx in sorted_tx_dict.values()]
+        if not messages_list:
+            await message.reply_text("📭 No transactions found.")
+            return
 
-        final_list = transactions_list[-10:]
+        older = None
+        if len(transactions) > self.TX_PAGE_SIZE:
+            older = InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            "⏪ Older transactions",
+                            callback_data=f"tx:{offset + self.TX_PAGE_SIZE}",
+                        )
+                    ]
+                ]
+            )
 
-        return final_list
+        for index, final_message in enumerate(messages_list):
+            await message.reply_text(
+                final_message,
+                parse_mode="MarkdownV2",
+                reply_markup=older if index == len(messages_list) - 1 else None,
+            )
 
     @log_info
-    async def get_transactions(self, update: Update, context: CallbackContext) -> None:
-        logger.info(
-            f"User {update.message.from_user.id} pressed Get Transactions at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-        )
-        await update.message.reply_text("♻️ Getting transactions...")
-
-        response = await self.get_transactions_logic(update.message.from_user.id)
-
-        messages_list = self.format_transactons(response)
+    async def older_transactions(
+        self, update: Update, context: CallbackContext
+    ) -> None:
+        query = update.callback_query
+        await query.answer()
 
-        last_tx = messages_list[-1]
-        db.set_last_tx(update.message.from_user.id, last_tx)
+        user = await self.storage.get_user(query.from_user.id)
+        if user is None or not user.bank_account_id or query.message is None:
+            return
 
-        for final_message in messages_list:
-            await update.message.reply_text(final_message, parse_mode="MarkdownV2")
+        # The button is used once, the new page carries its own
+        await query.edit_message_reply_markup(None)
+        await self.send_transaction_page(
+            query.message, user.bank_account_id, int(query.data.split(":")[1])
+        )
 
     async def notification_keyboard(
-        self, update: Update, context: CallbackContext
+        self, update: Update, context: CallbackContext, tx_notify: bool = None
     ) -> None:
-        if db.get_tx_notify(update.message.from_user.id)[0]:
+        if tx_notify is None:
+            user = await self.storage.get_user(update.message.from_user.id)
+            tx_notify = user.tx_notify
+
+        if tx_notify:
             settings_keyboard = [
                 [
                     KeyboardButton(
@@ -405,6 +533,27 @@ class BankBot:
             reply_markup=ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True),
         )
 
+    @log_info
+    async def profile(self, update: Update, context: CallbackContext) -> None:
+        if str(update.message.from_user.id) != os.getenv("ADMIN_ID"):
+            return
+        if not diagnostics.enabled():
+            await update.message.reply_text("🔬 Set DIAGNOSTICS=1 to enable profiling.")
+            return
+
+        try:
+            seconds = min(float(context.args[0]), 60) if context.args else 10
+        except ValueError:
+            await update.message.reply_text("🔬 Usage: /profile [seconds]")
+            return
+
+        await update.message.reply_text(f"🔬 Profiling for {seconds:.0f}s...")
+        try:
+            report = await self.profiler.profile(seconds)
+        except RuntimeError as e:
+            report = str(e)
+        await update.message.reply_text(report)
+
     @log_info
     async def notify_everyone(self, update: Update, context: CallbackContext):
         await update.message.reply_text("🗣 Enter notification:")
@@ -414,114 +563,355 @@ class BankBot:
     async def handle_notification(
         self, update: Update, context: CallbackContext
     ) -> int:
-        for telegram_id in db.get_telegram_ids():
-            if db.is_authorized(telegram_id):
-                await context.bot.send_message(
-                    chat_id=telegram_id,
-                    text=f"⚠️ NOTIFICATION FOR ALL USERS!⚠️\n\n{update.message.text}",
-                )
+        broadcast_id, recipients = await self.broadcaster.start(
+            update.message.from_user.id, update.message.text
+        )
 
-        await update.message.reply_text("🟢 Notifications successfully sent!")
+        await update.message.reply_text(
+            f"📨 Broadcast #{broadcast_id} queued for {recipients} users, progress will follow."
+        )
 
         return ConversationHandler.END
 
-    async def new_tx_trigger(self, context: CallbackContext) -> None:
-        job = context.job
-        chat_id = job.chat_id
+    async def new_tx_trigger(self, chat_id: int) -> float:
+        """Poll a subscriber's account and notify them of new transactions.
 
+        Returns the seconds until the next poll when the quota budget
+        defers it or polling is adaptive.
+        """
         logger.info(f"DOING JOB FOR {chat_id}")
 
-        current_last_tx = self.format_transactons(
-            await self.get_transactions_logic(chat_id)
-        )
+        user = await self.storage.get_user(chat_id)
+        account_id = user.bank_account_id
+
+        # When the budget defers the poll, come back once it allows one again
+        await self.quota.load(account_id, "transactions")
+        next_poll_at = self.quota.next_poll_at(account_id)
+        if next_poll_at > time.time():
+            return max(next_poll_at - time.time(), self.scheduler.min_interval)
 
-        current_last_tx = current_last_tx[-1]
+        try:
+            await self.sync_transactions(account_id, chat_id, interactive=False)
+        except QuotaExceeded as e:
+            return max(e.retry_at - time.time(), self.scheduler.min_interval)
 
-        last_tx = db.get_last_tx(chat_id)
+        new_transactions, seen_ids = await self.detect_new_transactions(user)
+
+        if seen_ids != user.seen_tx_ids:
+            self.storage.write(db.update_user, chat_id, seen_tx_ids=seen_ids)
+
+        if len(new_transactions) == 1:
+            header = "💸 NEW TRANSACTION CONFIRMED 💸\n\n"
+        else:
+            header = f"💸 {len(new_transactions)} NEW TRANSACTIONS CONFIRMED 💸\n\n"
 
-        if last_tx[0] != current_last_tx:
-            db.set_last_tx(chat_id, current_last_tx)
-            await context.bot.send_message(
+        # Several transactions found by one poll arrive as one alert
+        for message in tx_formatter.pack(
+            tx_formatter.format_batch(new_transactions), header
+        ):
+            await self.application.bot.send_message(
                 chat_id=chat_id,
-                text=f"💸 NEW TRANSACTION CONFIRMED 💸\n\n{current_last_tx}",
+                text=message,
                 parse_mode="MarkdownV2",
+                rate_limit_args={"priority": NOTIFICATION},
+            )
+
+        if self.polling is not None:
+            return await self.polling.next_interval(
+                chat_id, account_id, bool(new_transactions)
             )
 
-    def remove_job_if_exists(self, name: str, context: CallbackContext) -> bool:
-        """Remove job with given name. Returns whether job was removed."""
-        current_jobs = context.job_queue.get_jobs_by_name(name)
-        if not current_jobs:
-            return False
-        for job in current_jobs:
-            job.schedule_removal()
-        return True
+    async def detect_new_transactions(self, user: db.UserRecord) -> tuple:
+        """Return stored transactions whose IDs were not in the user's last check.
+
+        The newest SEEN_WINDOW stored transactions become the new seen set,
+        which is returned alongside for the caller to save. When nothing was
+        recorded before, no transactions are reported.
+        """
+        window = await self.storage.read(
+            db.get_recent_transactions, user.bank_account_id, self.SEEN_WINDOW
+        )
+
+        current_ids = {self.transaction_id(tx) for tx in window}
+        seen_ids = user.seen_tx_ids
 
+        if seen_ids is None:
+            return [], current_ids
+
+        new_transactions = {}
+        for tx in window:
+            tx_id = self.transaction_id(tx)
+            if tx_id not in seen_ids:
+                new_transactions.setdefault(tx_id, tx)
+
+        return list(new_transactions.values()), current_ids
+
+    @log_info
     async def enable_notificatons(
         self, update: Update, context: CallbackContext
     ) -> None:
         user_id = update.message.from_user.id
+        user = await self.storage.get_user(user_id)
 
-        db.set_tx_notify(user_id, True)
-
-        context.job_queue.run_repeating(
-            self.new_tx_trigger,
-            randint(60, 120),
-            chat_id=user_id,
-            name=f"tx_checker_{user_id}",
-            data=context,
-        )
-
-        response = await self.get_transactions_logic(user_id)
-        messages_list = self.format_transactons(response)
-
-        last_tx = db.get_last_tx(user_id)
-        current_last_tx = messages_list[-1:]
+        try:
+            await self.sync_transactions(user.bank_account_id, user_id)
+            _, seen_ids = await self.detect_new_transactions(user)
+            written = self.storage.write(
+                db.update_user, user_id, tx_notify=True, seen_tx_ids=seen_ids
+            )
+        except (QuotaExceeded, httpx.HTTPStatusError):
+            written = self.storage.write(db.update_user, user_id, tx_notify=True)
 
-        if last_tx[0] != current_last_tx[0]:
-            db.set_last_tx(user_id, current_last_tx[0])
+        # Polls start only once the subscription is stored
+        await written
+        if self.polling is not None:
+            self.polling.forget(user_id)
+        self.scheduler.add(user_id)
 
         await update.message.reply_text("🔈 Transactions notifications enabled.")
-        await self.notification_keyboard(update, context)
+        await self.notification_keyboard(update, context, tx_notify=True)
 
+    @log_info
     async def disable_notifications(
         self, update: Update, context: CallbackContext
     ) -> None:
         user_id = update.message.from_user.id
+        user = await self.storage.get_user(user_id)
 
-        job_removed = self.remove_job_if_exists(f"tx_checker_{user_id}", context)
+        job_removed = self.scheduler.remove(user_id, forget=True)
 
-        if job_removed:
-            db.set_tx_notify(update.message.from_user.id, False)
+        if job_removed or user.tx_notify:
+            self.storage.write(db.update_user, user_id, tx_notify=False)
             await update.message.reply_text("🔇 Transactions notifications disabled.")
-            await self.notification_keyboard(update, context)
+            await self.notification_keyboard(update, context, tx_notify=False)
         else:
             await update.message.reply_text(
                 "📟 Transactions notifications are not changed."
             )
 
-    def run_bot(self) -> None:
+    def collect_metrics(self):
+        """Counters kept by the bot's components, read on every scrape."""
+        scheduler = self.scheduler.stats()
+        users = db.users.stats()
+
+        refreshes = (
+            "bankbot_token_refreshes_total",
+            "counter",
+            "Access token refreshes",
+        )
+        broadcasts = (
+            "bankbot_broadcast_messages_total",
+            "counter",
+            "Broadcast deliveries",
+        )
+        lookups = ("bankbot_cache_lookups_total", "counter", "Cache lookups by result")
+        flights = (
+            "bankbot_singleflight_calls_total",
+            "counter",
+            "Coalesced upstream calls",
+        )
+
+        return [
+            (*refreshes, {"kind": "refresh"}, self.tokens.refresh_count),
+            (*refreshes, {"kind": "full_auth"}, self.tokens.full_auth_count),
+            (
+                "bankbot_polls_total",
+                "counter",
+                "Transaction polls started",
+                {},
+                scheduler["polls"],
+            ),
+            (
+                "bankbot_poll_failures_total",
+                "counter",
+                "Polls that raised",
+                {},
+                scheduler["failures"],
+            ),
+            (
+                "bankbot_polls_scheduled",
+                "gauge",
+                "Users being polled",
+                {},
+                scheduler["scheduled"],
+            ),
+            (
+                "bankbot_polls_in_flight",
+                "gauge",
+                "Polls running now",
+                {},
+                scheduler["in_flight"],
+            ),
+            (
+                "bankbot_polls_backing_off",
+                "gauge",
+                "Users whose last poll failed",
+                {},
+                scheduler["backing_off"],
+            ),
+            (*broadcasts, {"status": "sent"}, self.broadcaster.sent_total),
+            (*broadcasts, {"status": "failed"}, self.broadcaster.failed_total),
+            (
+                "bankbot_broadcasts_running",
+                "gauge",
+                "Broadcasts being sent",
+                {},
+                len(self.broadcaster.jobs),
+            ),
+            (*lookups, {"cache": "balance", "result": "hit"}, self.balances.hits),
+            (
+                *lookups,
+                {"cache": "balance", "result": "stale"},
+                self.balances.stale_hits,
+            ),
+            (*lookups, {"cache": "balance", "result": "miss"}, self.balances.misses),
+            (*lookups, {"cache": "user", "result": "hit"}, users["hits"]),
+            (*lookups, {"cache": "user", "result": "miss"}, users["misses"]),
+            (
+                "bankbot_user_cache_size",
+                "gauge",
+                "User records in memory",
+                {},
+                users["size"],
+            ),
+            (*flights, {"result": "started"}, self.flights.started),
+            (*flights, {"result": "shared"}, self.flights.shared),
+            (
+                "bankbot_db_writes_total",
+                "counter",
+                "Database writes applied",
+                {},
+                self.storage.writes,
+            ),
+            (
+                "bankbot_db_commits_total",
+                "counter",
+                "Database group commits",
+                {},
+                self.storage.commits,
+            ),
+            (
+                "bankbot_sdk_queue_depth",
+                "gauge",
+                "SDK calls waiting for a thread",
+                {},
+                self.sdk.queue_depth,
+            ),
+        ]
+
+    async def on_post_init(self, application) -> None:
+        await self.storage.start()
+        await self.api.start()
+        self.scheduler = PollScheduler(self.new_tx_trigger, storage=self.storage)
+        if self.poll_locally:
+            await self.restore_subscribers()
+            self.scheduler.start()
+        else:
+            logger.info("Transaction polling is left to worker processes")
+        self.broadcaster = Broadcaster(application.bot, self.storage)
+        await self.broadcaster.resume()
+        REGISTRY.add_collector(self.collect_metrics)
+        await self.metrics.start()
+        if diagnostics.enabled():
+            self.monitor.start()
+
+    async def restore_subscribers(self) -> None:
+        """Schedule every subscriber at boot instead of waiting for their /start."""
+        subscribers = await self.storage.read(db.get_users_to_notify)
+        restored = await self.scheduler.restore(
+            telegram_id
+            for telegram_id, settings in subscribers.items()
+            if settings["tx_notify"]
+        )
+        logger.info(f"Restored {restored} notification subscribers")
+
+    def save_tokens(self, state: dict) -> None:
+        self.storage.write(
+            db.set_cached,
+            self.TOKEN_CACHE_KEY,
+            decoding.dumps(state),
+            state["refresh_expires_at"],
+        )
+
+    async def on_post_stop(self, application) -> None:
+        # Runs before the bot shuts down, so finishing polls can still notify
+        await self.scheduler.stop()
+
+    async def on_post_shutdown(self, application) -> None:
+        await self.monitor.stop()
+        await self.metrics.close()
+        await self.broadcaster.stop()
+        await self.api.close()
+        self.sdk.shutdown()
+        await self.storage.close()
+
+    def setup(self) -> None:
+        """Prepare the database and the GoCardless SDK client."""
         db.db_init()
         logger.success(
             f"Database initialized at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         )
 
         self.client = NordigenClient(
-            secret_id=os.getenv("SECRET_ID"), secret_key=os.getenv("SECRET_KEY")
+            secret_id=os.getenv("SECRET_ID"),
+            secret_key=os.getenv("SECRET_KEY"),
+            base_url=self.api.base_url,
         )
+        self.sdk = SdkPool(self.client)
         logger.success(f"Client created at {datetime.now().strftime('%d.%m.%Y %H:%M')}")
 
-        self.init_token = self.client.generate_token()
+        # Tokens from the last run are reused, otherwise the first request authenticates
+        self.tokens = TokenManager(self.sdk, on_change=self.save_tokens)
+        cached_tokens = db.get_cached(self.TOKEN_CACHE_KEY)
+        if cached_tokens and self.tokens.restore(decoding.loads(cached_tokens)):
+            logger.info("Restored GoCardless tokens from the database")
+
+        self.institution_id = db.get_cached(self.INSTITUTION_CACHE_KEY)
+        if self.institution_id is None:
+            # The lookup downloads every Swedish institution, so it is cached
+            if not self.tokens.access_valid():
+                self.tokens.set(self.client.generate_token())
+                state = self.tokens.snapshot()
+                db.set_cached(
+                    self.TOKEN_CACHE_KEY,
+                    decoding.dumps(state),
+                    state["refresh_expires_at"],
+                )
 
-        self.institution_id = self.client.institution.get_institution_id_by_name(
-            country="SE", institution="Nordea Personal"
-        )
+            self.institution_id = self.client.institution.get_institution_id_by_name(
+                country="SE", institution="Nordea Personal"
+            )
+            db.set_cached(
+                self.INSTITUTION_CACHE_KEY,
+                self.institution_id,
+                time.time() + self.INSTITUTION_CACHE_TTL,
+            )
 
         logger.success(
             f"Bank data received at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         )
 
-        self.application = ApplicationBuilder().token(self.bot_token).build()
+    def build_application(self):
+        """Create the Telegram application with every handler registered."""
+        self.application = (
+            ApplicationBuilder()
+            .token(self.bot_token)
+            .base_url(os.getenv("TELEGRAM_BASE_URL", "https://api.telegram.org/bot"))
+            .request(MeteredRequest(connection_pool_size=256))
+            .rate_limiter(OutboundDispatcher())
+            .concurrent_updates(
+                UserOrderedUpdateProcessor(int(os.getenv("CONCURRENT_UPDATES", 32)))
+            )
+            .post_init(self.on_post_init)
+            .post_stop(self.on_post_stop)
+            .post_shutdown(self.on_post_shutdown)
+            .build()
+        )
         self.application.add_handler(CommandHandler("start", self.on_start))
+        # Runs as its own task so the updates it should observe keep flowing
+        self.application.add_handler(
+            CommandHandler("profile", self.profile, block=False)
+        )
 
         self.application.add_handler(
             MessageHandler(filters.Text("💠 Login"), self.bank_init)
@@ -533,6 +923,9 @@ class BankBot:
         self.application.add_handler(
             MessageHandler(filters.Text("📇 Get Transactions"), self.get_transactions)
         )
+        self.application.add_handler(
+            CallbackQueryHandler(self.older_transactions, pattern=r"^tx:\d+$")
+        )
         self.application.add_handler(
             MessageHandler(filters.Text("⬅️ Back"), self.back_button_handler)
         )
@@ -578,7 +971,31 @@ class BankBot:
             f"Bot initialized successfully at {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         )
 
-        self.application.run_polling()
+        return self.application
+
+    def run_bot(self) -> None:
+        self.setup()
+        application = self.build_application()
+
+        if os.getenv("BOT_MODE", "polling") != "webhook":
+            application.run_polling()
+            return
+
+        webhook_url = os.getenv("WEBHOOK_URL")
+        if not webhook_url:
+            raise ValueError("WEBHOOK_URL must be set when BOT_MODE is webhook")
+
+        # Telegram sends the secret back in a header, PTB rejects requests without it
+        secret_token = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+        application.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+            port=int(os.getenv("WEBHOOK_PORT", 8443)),
+            url_path=os.getenv("WEBHOOK_PATH", "telegram"),
+            webhook_url=webhook_url,
+            secret_token=secret_token,
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,204 @@
+from telegram.error import BadRequest, Forbidden, NetworkError, TelegramError
+from outbound import BROADCAST
+from loguru import logger
+import database as db
+import asyncio
+import time
+import os
+
+
+# Broadcasts use the lowest outbound lane, behind replies and notifications
+LANE = {"priority": BROADCAST}
+
+
+class Broadcaster:
+    """Sends admin broadcasts concurrently through the outbound dispatcher.
+
+    Every broadcast is recorded in the ``broadcasts`` and
+    ``broadcast_recipients`` tables before the first message goes out, and
+    each recipient is marked once delivered. An interrupted broadcast
+    resumes with the recipients that are still pending. Rate limits and
+    flood control are left to the dispatcher's broadcast lane.
+    """
+
+    PROGRESS_INTERVAL = 3
+
+    def __init__(
+        self,
+        bot,
+        storage,
+        concurrency: int = None,
+        max_retries: int = None,
+    ):
+        self.bot = bot
+        self.storage = storage
+        self.concurrency = concurrency or int(os.getenv("BROADCAST_CONCURRENCY", 10))
+        self.max_retries = max_retries or int(os.getenv("BROADCAST_MAX_RETRIES", 3))
+        self.jobs = {}
+        self.sent_total = 0
+        self.failed_total = 0
+
+    @staticmethod
+    def message_text(text: str) -> str:
+        return f"⚠️ NOTIFICATION FOR ALL USERS!⚠️\n\n{text}"
+
+    async def start(self, admin_id: int, text: str) -> tuple:
+        """Record a broadcast to every authorized user and start sending it.
+
+        Returns the broadcast id and the number of recipients.
+        """
+        recipients = await self.storage.read(db.get_authorized_ids)
+        broadcast_id = await self.storage.write(
+            db.create_broadcast, admin_id, text, recipients, time.time()
+        )
+        self._spawn(broadcast_id, admin_id, text, recipients, 0)
+        return broadcast_id, len(recipients)
+
+    async def resume(self) -> None:
+        """Continue every broadcast that was still running at shutdown."""
+        for broadcast_id, admin_id, text in await self.storage.read(
+            db.get_unfinished_broadcasts
+        ):
+            recipients = await self.storage.read(
+                db.get_pending_recipients, broadcast_id
+            )
+            progress = await self.storage.read(db.get_broadcast_progress, broadcast_id)
+            logger.info(
+                f"Resuming broadcast {broadcast_id} with {len(recipients)} recipients left"
+            )
+            self._spawn(
+                broadcast_id,
+                admin_id,
+                text,
+                recipients,
+                sum(progress.values()) - len(recipients),
+            )
+
+    async def stop(self) -> None:
+        # Stopped broadcasts stay 'running' in the database and resume on start
+        for task in list(self.jobs.values()):
+            task.cancel()
+        await asyncio.gather(*self.jobs.values(), return_exceptions=True)
+
+    def _spawn(self, broadcast_id, admin_id, text, recipients, done) -> None:
+        task = asyncio.create_task(
+            self._run(broadcast_id, admin_id, text, recipients, done)
+        )
+        self.jobs[broadcast_id] = task
+        task.add_done_callback(lambda _: self.jobs.pop(broadcast_id, None))
+
+    async def _run(self, broadcast_id, admin_id, text, recipients, done) -> None:
+        queue = asyncio.Queue()
+        for telegram_id in recipients:
+            queue.put_nowait(telegram_id)
+
+        progress = {
+            "total": done + len(recipients),
+            "done": done,
+            "sent": 0,
+            "failed": 0,
+            "started": time.monotonic(),
+        }
+
+        status_message = await self._safe_send(
+            admin_id,
+            f"📣 Broadcast #{broadcast_id} started for {progress['total']} users",
+        )
+        reporter = asyncio.create_task(
+            self._report(broadcast_id, admin_id, status_message, progress)
+        )
+
+        try:
+            await asyncio.gather(
+                *(
+                    self._worker(broadcast_id, self.message_text(text), queue, progress)
+                    for _ in range(min(self.concurrency, max(1, len(recipients))))
+                )
+            )
+        finally:
+            reporter.cancel()
+
+        await self.storage.write(db.set_broadcast_status, broadcast_id, "done")
+        await self._edit_progress(broadcast_id, admin_id, status_message, progress)
+        await self._safe_send(admin_id, "🟢 Notifications successfully sent!")
+
+    async def _worker(self, broadcast_id, text, queue, progress) -> None:
+        while True:
+            try:
+                telegram_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            status = await self._deliver(telegram_id, text)
+
+            progress["done"] += 1
+            progress[status] += 1
+            if status == "sent":
+                self.sent_total += 1
+            else:
+                self.failed_total += 1
+
+            # Queued writes are group-committed by the storage writer
+            self.storage.write(
+                db.set_recipient_statuses, broadcast_id, [(telegram_id, status)]
+            )
+
+    async def _deliver(self, chat_id, text) -> str:
+        failures = 0
+
+        while True:
+            try:
+                await self.bot.send_message(
+                    chat_id=chat_id, text=text, rate_limit_args=LANE
+                )
+                return "sent"
+            except (Forbidden, BadRequest) as e:
+                logger.info(f"Broadcast to {chat_id} failed: {e}")
+                return "failed"
+            except NetworkError as e:
+                failures += 1
+                if failures > self.max_retries:
+                    logger.warning(f"Broadcast to {chat_id} failed after retries: {e}")
+                    return "failed"
+                await asyncio.sleep(2**failures)
+            except TelegramError as e:
+                # Anything else, such as a migrated group chat or flood control
+                # that outlasted the dispatcher's retries, fails this recipient
+                logger.warning(f"Broadcast to {chat_id} failed: {e}")
+                return "failed"
+
+    async def _report(self, broadcast_id, admin_id, status_message, progress) -> None:
+        while True:
+            await asyncio.sleep(self.PROGRESS_INTERVAL)
+            await self._edit_progress(broadcast_id, admin_id, status_message, progress)
+
+    async def _edit_progress(self, broadcast_id, admin_id, status_message, progress):
+        if status_message is None:
+            return
+
+        elapsed = max(time.monotonic() - progress["started"], 1e-6)
+        text = (
+            f"📣 Broadcast #{broadcast_id}: {progress['done']}/{progress['total']} done\n"
+            f"✅ Sent: {progress['sent']}  ❌ Failed: {progress['failed']}\n"
+            f"⚡️ {(progress['sent'] + progress['failed']) / elapsed:.1f} msg/s"
+        )
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=admin_id,
+                message_id=status_message.message_id,
+                rate_limit_args=LANE,
+            )
+        except BadRequest:
+            pass  # Text did not change since the last report
+        except TelegramError as e:
+            logger.warning(f"Could not update broadcast progress: {e}")
+
+    async def _safe_send(self, chat_id, text):
+        try:
+            return await self.bot.send_message(
+                chat_id=chat_id, text=text, rate_limit_args=LANE
+            )
+        except TelegramError as e:
+            logger.warning(f"Could not message admin {chat_id}: {e}")
+            return None
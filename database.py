@@ -1,12 +1,84 @@
+from typing import NamedTuple, Optional
+from user_cache import UserCache
 import sqlite3 as sq
+import threading
+import decoding
 import json
+import time
+import os
+
+DB_PATH = os.getenv("DB_PATH", "bank_users.db")
+
+USER_COLUMNS = (
+    "telegram_id",
+    "auth_link",
+    "requisition_id",
+    "bank_account_id",
+    "is_authorized",
+    "tx_notify",
+    "last_tx",
+    "seen_tx_ids",
+)
+
+SELECT_USER = f"SELECT {', '.join(USER_COLUMNS)} FROM bank_users WHERE telegram_id = ?"
+
+_local = threading.local()
+
+users = UserCache()
+
+# Storage's writer calls write functions with commit=False and commits the
+# batch itself. Their errors are raised in that case so the writer can hand
+# them to the caller's future instead of only printing them.
+
+
+class UserRecord(NamedTuple):
+    telegram_id: int
+    auth_link: Optional[str]
+    requisition_id: Optional[str]
+    bank_account_id: Optional[str]
+    is_authorized: bool
+    tx_notify: bool
+    last_tx: Optional[str]
+    seen_tx_ids: Optional[set]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row[0],
+            row[1],
+            row[2],
+            row[3],
+            bool(row[4]),
+            bool(row[5]),
+            row[6],
+            set(json.loads(row[7])) if row[7] is not None else None,
+        )
+
+
+def connect(path=None):
+    conn = sq.connect(path or DB_PATH, cached_statements=256)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(
+        "PRAGMA synchronous = NORMAL"
+    )  # Durable across app crashes in WAL mode
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")  # 16 MB page cache
+    conn.execute("PRAGMA mmap_size = 67108864")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
 
-db = sq.connect("bank_users.db")
-cur = db.cursor()
+
+def get_connection():
+    # sqlite3 connections must not be shared between threads, so each gets its own
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
 
 
 def db_init():
-    cur.execute(
+    conn = get_connection()
+    conn.execute(
         "CREATE TABLE IF NOT EXISTS bank_users ("
         "telegram_id INTEGER PRIMARY KEY, "
         "auth_link TEXT, "
@@ -14,11 +86,140 @@ def db_init():
         "bank_account_id TEXT, "
         "is_authorized INTEGER DEFAULT 0, "
         "tx_notify INTEGER DEFAULT 0, "
-        "last_tx TEXT"
+        "last_tx TEXT, "
+        "seen_tx_ids TEXT"
+        ")"
+    )
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(bank_users)")]
+    if "seen_tx_ids" not in columns:
+        conn.execute("ALTER TABLE bank_users ADD COLUMN seen_tx_ids TEXT")
+
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS api_quota ("
+        "account_id TEXT, "
+        "endpoint TEXT, "
+        "day_limit INTEGER, "
+        "remaining INTEGER, "
+        "reset_at REAL, "
+        "retry_after_until REAL, "
+        "interactive_used INTEGER DEFAULT 0, "
+        "last_poll_at REAL, "
+        "PRIMARY KEY (account_id, endpoint)"
+        ")"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS transactions ("
+        "account_id TEXT, "
+        "tx_id TEXT, "
+        "status TEXT, "
+        "booking_date TEXT, "
+        "sort_key TEXT, "
+        "payload TEXT, "
+        "PRIMARY KEY (account_id, tx_id)"
+        ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_booking_date "
+        "ON transactions (account_id, booking_date)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS broadcasts ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "admin_id INTEGER, "
+        "text TEXT, "
+        "status TEXT DEFAULT 'running', "
+        "created_at REAL"
+        ")"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS broadcast_recipients ("
+        "broadcast_id INTEGER, "
+        "telegram_id INTEGER, "
+        "status TEXT DEFAULT 'pending', "
+        "PRIMARY KEY (broadcast_id, telegram_id)"
+        ")"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS poll_workers ("
+        "worker_id TEXT PRIMARY KEY, "
+        "started_at REAL, "
+        "heartbeat REAL"
+        ")"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS poll_state ("
+        "telegram_id INTEGER PRIMARY KEY, "
+        "next_due REAL, "
+        "last_poll_at REAL, "
+        "last_result TEXT, "
+        "failures INTEGER DEFAULT 0"
+        ")"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS app_cache ("
+        "key TEXT PRIMARY KEY, "
+        "value TEXT, "
+        "expires_at REAL"
         ")"
     )
 
-    db.commit()
+    conn.commit()
+
+
+def get_user(telegram_id) -> Optional[UserRecord]:
+    """Return the whole bank_users row of a user, or None if there is none."""
+    return users.get(telegram_id) or load_user(telegram_id)
+
+
+def load_user(telegram_id) -> Optional[UserRecord]:
+    """Read a user from SQLite, bypassing and then filling the user cache."""
+    started = users.load_started()
+    user = None
+    try:
+        row = get_connection().execute(SELECT_USER, (telegram_id,)).fetchone()
+        if row is not None:
+            user = UserRecord.from_row(row)
+    except sq.Error as e:
+        print("Error getting user:", e)
+    finally:
+        users.loaded(telegram_id, user, started)
+    return user
+
+
+def update_user(telegram_id, commit=True, **fields):
+    """Write any number of bank_users columns of a user in one statement."""
+    unknown = set(fields) - set(USER_COLUMNS[1:])
+    if unknown:
+        raise ValueError(f"Unknown bank_users columns: {', '.join(sorted(unknown))}")
+
+    values = dict(fields)
+    if values.get("seen_tx_ids") is not None:
+        values["seen_tx_ids"] = json.dumps(sorted(values["seen_tx_ids"]))
+
+    try:
+        conn = get_connection()
+        conn.execute(
+            f"UPDATE bank_users SET {', '.join(f'{name} = ?' for name in values)} "
+            "WHERE telegram_id = ?",
+            (*values.values(), telegram_id),
+        )
+        if commit:
+            conn.commit()
+        print(f"{', '.join(fields)} updated for user {telegram_id}")
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error updating user:", e)
+        users.invalidate(telegram_id)
+        return
+
+    for flag in ("is_authorized", "tx_notify"):
+        if flag in fields:
+            fields[flag] = bool(fields[flag])
+    users.write(telegram_id, **fields)
+    if commit:
+        users.committed()
 
 
 def insert_user(
@@ -29,11 +230,13 @@ def insert_user(
     is_authorized=False,
     tx_notify=False,
     last_tx=None,
+    commit=True,
 ):
     try:
-        cur.execute(
-            "INSERT INTO bank_users (telegram_id, auth_link, requisition_id, bank_account_id, is_authorized, tx_notify, last_tx) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?,)",
+        conn = get_connection()
+        inserted = conn.execute(
+            "INSERT OR IGNORE INTO bank_users (telegram_id, auth_link, requisition_id, bank_account_id, is_authorized, tx_notify, last_tx) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
             (
                 telegram_id,
                 auth_link,
@@ -43,254 +246,502 @@ def insert_user(
                 tx_notify,
                 last_tx,
             ),
-        )
-        db.commit()
+        ).rowcount
+        if commit:
+            conn.commit()
         print("User inserted successfully.")
     except sq.Error as e:
+        if not commit:
+            raise
         print("Error inserting user:", e)
+        return
+
+    if inserted:
+        users.write(
+            telegram_id,
+            UserRecord(
+                telegram_id,
+                auth_link,
+                requisition_id,
+                bank_account_id,
+                bool(is_authorized),
+                bool(tx_notify),
+                last_tx,
+                None,
+            ),
+        )
+        if commit:
+            users.committed()
 
 
 def user_exists(telegram_id):
-    try:
-        cur.execute(
-            "SELECT COUNT(*) FROM bank_users WHERE telegram_id = ?", (telegram_id,)
-        )
-        count = cur.fetchone()[0]
-        return count > 0  # Return True if the user exists, False otherwise
-    except sq.Error as e:
-        print("Error checking user existence:", e)
-        return False  # Return False on error
+    return get_user(telegram_id) is not None
 
 
 def is_authorized(telegram_id):
-    try:
-        cur.execute(
-            "SELECT is_authorized FROM bank_users WHERE telegram_id = ?", (telegram_id,)
-        )
-        result = cur.fetchone()
-        if result is not None:
-            return bool(
-                result[0]
-            )  # Return True if the user is authorized, False otherwise
-        else:
-            return False  # User not found, return False
-    except sq.Error as e:
-        print("Error checking authorization:", e)
-        return False  # Return False on error
+    user = get_user(telegram_id)
+    return user is not None and user.is_authorized
 
 
 def check_user_authorization(telegram_id):
-    if user_exists(telegram_id):
-        return (
-            True,
-            is_authorized(telegram_id),
-        )  # Return a tuple (True, True) or (True, False) based on existence and authorization
-    else:
+    user = get_user(telegram_id)
+    if user is None:
         return (False, False)
+    return (True, user.is_authorized)
 
 
 def get_auth_link(telegram_id):
+    user = get_user(telegram_id)
+    return user.auth_link if user is not None else None
+
+
+def get_requisition_id(telegram_id):
+    user = get_user(telegram_id)
+    return user.requisition_id if user is not None else None
+
+
+def get_account_id(telegram_id):
+    user = get_user(telegram_id)
+    return user.bank_account_id if user is not None else None
+
+
+def insert_auth_link(telegram_id, auth_link):
+    update_user(telegram_id, auth_link=auth_link)
+
+
+def insert_requisition_id(telegram_id, requisition_id):
+    update_user(telegram_id, requisition_id=requisition_id)
+
+
+def insert_account_id(telegram_id, bank_account_id):
+    update_user(telegram_id, bank_account_id=bank_account_id)
+
+
+def insert_is_authorized(telegram_id, is_authorized):
+    update_user(telegram_id, is_authorized=is_authorized)
+
+
+def get_tx_notify(telegram_id):
+    user = get_user(telegram_id)
+    if user is None:
+        print(f"User with telegram_id {telegram_id} not found.")
+        return None
+    return (user.tx_notify,)
+
+
+def set_tx_notify(telegram_id: int, value: bool) -> None:
+    update_user(telegram_id, tx_notify=value)
+
+
+def get_telegram_ids() -> list:
     try:
-        cur.execute(
-            "SELECT auth_link FROM bank_users WHERE telegram_id = ?", (telegram_id,)
-        )
-        result = cur.fetchone()
-        if result is not None:
-            return result[0]  # Return the auth_link if the user is found
-        else:
-            return None  # User not found, return None
+        return [
+            telegram_id
+            for (telegram_id,) in get_connection().execute(
+                "SELECT telegram_id FROM bank_users"
+            )
+        ]
     except sq.Error as e:
-        print("Error retrieving auth link:", e)
-        return None  # Return None on error
+        print("Error fetching telegram_ids:", e)
+        return []
 
 
-def get_requisition_id(telegram_id):
+def get_authorized_ids() -> list:
     try:
-        cur.execute(
-            "SELECT requisition_id FROM bank_users WHERE telegram_id = ?",
-            (telegram_id,),
-        )
-        result = cur.fetchone()
-        if result is not None:
-            return result[0]  # Return the requisition_id if the user is found
-        else:
-            return None  # User not found, return None
+        return [
+            telegram_id
+            for (telegram_id,) in get_connection().execute(
+                "SELECT telegram_id FROM bank_users WHERE is_authorized = 1"
+            )
+        ]
     except sq.Error as e:
-        print("Error retrieving requisition ID:", e)
-        return None  # Return None on error
+        print("Error fetching authorized telegram_ids:", e)
+        return []
 
 
-def get_account_id(telegram_id):
+def get_users_to_notify():
     try:
-        cur.execute(
-            "SELECT bank_account_id FROM bank_users WHERE telegram_id = ?",
-            (telegram_id,),
+        user_records = get_connection().execute(
+            "SELECT telegram_id, tx_notify FROM bank_users"
         )
-        result = cur.fetchone()
-        if result is not None:
-            return result[0]  # Return the bank_account_id if the user is found
-        else:
-            return None  # User not found, return None
+        return {
+            telegram_id: {"tx_notify": bool(tx_notify)}
+            for telegram_id, tx_notify in user_records
+        }
     except sq.Error as e:
-        print("Error retrieving bank account ID:", e)
-        return None  # Return None on error
+        print("Error fetching user info:", e)
+        return {}
 
 
-def insert_auth_link(telegram_id, auth_link):
+def get_last_tx(telegram_id):
+    user = get_user(telegram_id)
+    if user is None:
+        print(f"User with telegram_id {telegram_id} not found.")
+        return None
+    return (user.last_tx,)
+
+
+def set_last_tx(telegram_id, last_tx):
+    update_user(telegram_id, last_tx=last_tx)
+
+
+def get_seen_tx_ids(telegram_id):
+    user = get_user(telegram_id)
+    return user.seen_tx_ids if user is not None else None
+
+
+def set_seen_tx_ids(telegram_id, seen_tx_ids):
+    update_user(telegram_id, seen_tx_ids=seen_tx_ids)
+
+
+def store_transactions(account_id, rows, commit=True):
+    # rows: (tx_id, status, booking_date, sort_key, payload)
     try:
-        cur.execute(
-            "UPDATE bank_users SET auth_link = ? WHERE telegram_id = ?",
-            (auth_link, telegram_id),
+        conn = get_connection()
+        # Pending entries change or disappear, so they are replaced on every sync
+        conn.execute(
+            "DELETE FROM transactions WHERE account_id = ? AND status = 'pending'",
+            (account_id,),
         )
-        db.commit()
-        print(f"Auth Link updated for user {telegram_id}")
+        conn.executemany(
+            "INSERT INTO transactions (account_id, tx_id, status, booking_date, sort_key, payload) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (account_id, tx_id) DO UPDATE SET "
+            "status = excluded.status, booking_date = excluded.booking_date, "
+            "sort_key = excluded.sort_key, payload = excluded.payload",
+            [(account_id, *row) for row in rows],
+        )
+        if commit:
+            conn.commit()
     except sq.Error as e:
-        print("Error updating auth link:", e)
+        if not commit:
+            raise
+        print("Error storing transactions:", e)
 
 
-def insert_requisition_id(telegram_id, requisition_id):
+def get_latest_booking_date(account_id):
     try:
-        cur.execute(
-            "UPDATE bank_users SET requisition_id = ? WHERE telegram_id = ?",
-            (requisition_id, telegram_id),
+        return (
+            get_connection()
+            .execute(
+                "SELECT MAX(booking_date) FROM transactions "
+                "WHERE account_id = ? AND status = 'booked'",
+                (account_id,),
+            )
+            .fetchone()[0]
+        )  # None if nothing is stored yet
+    except sq.Error as e:
+        print("Error getting latest booking date:", e)
+        return None
+
+
+def get_recent_transactions(account_id, limit=10, offset=0) -> list:
+    try:
+        rows = get_connection().execute(
+            "SELECT payload FROM transactions WHERE account_id = ? "
+            "ORDER BY booking_date DESC, sort_key DESC LIMIT ? OFFSET ?",
+            (account_id, limit, offset),
         )
-        db.commit()
-        print(f"Requisition ID updated for user {telegram_id}")
+        return [decoding.loads(payload) for (payload,) in rows]
     except sq.Error as e:
-        print("Error updating requisition ID:", e)
+        print("Error getting transactions:", e)
+        return []
 
 
-def insert_account_id(telegram_id, bank_account_id):
+def get_transaction_times(account_id, since) -> list:
     try:
-        cur.execute(
-            "UPDATE bank_users SET bank_account_id = ? WHERE telegram_id = ?",
-            (bank_account_id, telegram_id),
+        return (
+            get_connection()
+            .execute(
+                "SELECT booking_date, sort_key FROM transactions "
+                "WHERE account_id = ? AND booking_date >= ?",
+                (account_id, since),
+            )
+            .fetchall()
         )
-        db.commit()
-        print(f"Bank Account ID updated for user {telegram_id}")
     except sq.Error as e:
-        print("Error updating bank account ID:", e)
+        print("Error getting transaction times:", e)
+        return []
 
 
-def insert_is_authorized(telegram_id, is_authorized):
+def get_quota(account_id, endpoint):
     try:
-        cur.execute(
-            "UPDATE bank_users SET is_authorized = ? WHERE telegram_id = ?",
-            (is_authorized, telegram_id),
+        return (
+            get_connection()
+            .execute(
+                "SELECT day_limit, remaining, reset_at, retry_after_until, interactive_used, last_poll_at "
+                "FROM api_quota WHERE account_id = ? AND endpoint = ?",
+                (account_id, endpoint),
+            )
+            .fetchone()
         )
-        db.commit()
-        print(f"is_authorized updated for user {telegram_id} to {is_authorized}")
     except sq.Error as e:
-        print("Error updating is_authorized:", e)
+        print("Error getting quota:", e)
+        return None
 
 
-def get_tx_notify(telegram_id):
+def update_quota(
+    account_id,
+    endpoint,
+    values,
+    spent=False,
+    interactive=False,
+    day_limit=None,
+    commit=True,
+):
+    """Change only the given columns of a quota row, creating it if needed.
+
+    ``spent`` takes one call off ``remaining`` and ``interactive`` adds one
+    to ``interactive_used`` in SQL, so processes sharing the budget do not
+    overwrite each other's counts.
+    """
+    assignments = [f"{name} = ?" for name in values]
+    if spent:
+        assignments.append("remaining = MAX(0, remaining - 1)")
+    if interactive:
+        assignments.append("interactive_used = interactive_used + 1")
+    if not assignments:
+        return
+
     try:
-        # Select tx_notify for the specified telegram_id
-        cur.execute(
-            "SELECT tx_notify FROM bank_users WHERE telegram_id = ?", (telegram_id,)
+        conn = get_connection()
+        conn.execute(
+            "INSERT OR IGNORE INTO api_quota (account_id, endpoint, day_limit, remaining) "
+            "VALUES (?, ?, ?, ?)",
+            (account_id, endpoint, day_limit, day_limit),
+        )
+        conn.execute(
+            f"UPDATE api_quota SET {', '.join(assignments)} "
+            "WHERE account_id = ? AND endpoint = ?",
+            (*values.values(), account_id, endpoint),
         )
-        result = cur.fetchone()
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error updating quota:", e)
 
-        if result:
-            return result
-        else:
-            print(f"User with telegram_id {telegram_id} not found.")
-            return None
 
+def create_broadcast(admin_id, text, recipients, created_at, commit=True):
+    """Record a broadcast and its recipients. Returns the new broadcast id."""
+    try:
+        conn = get_connection()
+        broadcast_id = conn.execute(
+            "INSERT INTO broadcasts (admin_id, text, created_at) VALUES (?, ?, ?)",
+            (admin_id, text, created_at),
+        ).lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, telegram_id) VALUES (?, ?)",
+            [(broadcast_id, telegram_id) for telegram_id in recipients],
+        )
+        if commit:
+            conn.commit()
+        return broadcast_id
     except sq.Error as e:
-        print("Error getting tx_notify:", e)
+        if not commit:
+            raise
+        print("Error creating broadcast:", e)
         return None
 
 
-def set_tx_notify(telegram_id: int, value: bool) -> None:
+def set_recipient_statuses(broadcast_id, statuses, commit=True):
+    # statuses: (telegram_id, status)
+    try:
+        conn = get_connection()
+        conn.executemany(
+            "UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND telegram_id = ?",
+            [(status, broadcast_id, telegram_id) for telegram_id, status in statuses],
+        )
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error updating broadcast recipients:", e)
+
+
+def set_broadcast_status(broadcast_id, status, commit=True):
     try:
-        # Update the tx_notify field for the specified telegram_id
-        cur.execute(
-            "UPDATE bank_users SET tx_notify = ? WHERE telegram_id = ?",
-            (value, telegram_id),
+        conn = get_connection()
+        conn.execute(
+            "UPDATE broadcasts SET status = ? WHERE id = ?", (status, broadcast_id)
         )
-        db.commit()
-        print(f"tx_notify updated for user {telegram_id} to {value}")
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error updating broadcast:", e)
+
 
+def get_unfinished_broadcasts() -> list:
+    try:
+        return (
+            get_connection()
+            .execute(
+                "SELECT id, admin_id, text FROM broadcasts WHERE status = 'running' ORDER BY id"
+            )
+            .fetchall()
+        )
     except sq.Error as e:
-        print("Error updating tx_notify:", e)
+        print("Error fetching broadcasts:", e)
+        return []
 
 
-def get_telegram_ids() -> list:
-    ids_list = []
+def get_broadcast_progress(broadcast_id) -> dict:
+    """Return recipient counts of a broadcast keyed by status."""
     try:
-        # Select all users' telegram_id values
-        cur.execute("SELECT telegram_id FROM bank_users")
-        telegram_ids = cur.fetchall()
+        return dict(
+            get_connection()
+            .execute(
+                "SELECT status, COUNT(*) FROM broadcast_recipients "
+                "WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,),
+            )
+            .fetchall()
+        )
+    except sq.Error as e:
+        print("Error fetching broadcast progress:", e)
+        return {}
 
-        for telegram_id in telegram_ids:
-            ids_list.append(telegram_id[0])
 
-        return ids_list
+def get_pending_recipients(broadcast_id) -> list:
+    try:
+        return [
+            telegram_id
+            for (telegram_id,) in get_connection().execute(
+                "SELECT telegram_id FROM broadcast_recipients "
+                "WHERE broadcast_id = ? AND status = 'pending'",
+                (broadcast_id,),
+            )
+        ]
+    except sq.Error as e:
+        print("Error fetching broadcast recipients:", e)
+        return []
+
 
+def renew_worker_lease(worker_id, now, commit=True):
+    try:
+        conn = get_connection()
+        conn.execute(
+            "INSERT INTO poll_workers (worker_id, started_at, heartbeat) VALUES (?, ?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (worker_id, now, now),
+        )
+        if commit:
+            conn.commit()
     except sq.Error as e:
-        print("Error fetching telegram_ids:", e)
+        if not commit:
+            raise
+        print("Error renewing worker lease:", e)
 
 
-def get_users_to_notify():
+def release_worker_lease(worker_id, commit=True):
     try:
-        # Select all users' telegram_id and tx_notify
-        cur.execute("SELECT telegram_id, tx_notify FROM bank_users")
-        user_records = cur.fetchall()
+        conn = get_connection()
+        conn.execute("DELETE FROM poll_workers WHERE worker_id = ?", (worker_id,))
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error releasing worker lease:", e)
+
 
-        user_info_dict = {}
-        for record in user_records:
-            telegram_id, tx_notify = record
-            user_info_dict[telegram_id] = {"tx_notify": bool(tx_notify)}
+def expire_worker_leases(before, commit=True):
+    try:
+        conn = get_connection()
+        conn.execute("DELETE FROM poll_workers WHERE heartbeat < ?", (before,))
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error expiring worker leases:", e)
 
-        return user_info_dict
 
+def get_live_workers(since) -> list:
+    try:
+        return [
+            worker_id
+            for (worker_id,) in get_connection().execute(
+                "SELECT worker_id FROM poll_workers WHERE heartbeat >= ? ORDER BY worker_id",
+                (since,),
+            )
+        ]
     except sq.Error as e:
-        print("Error fetching user info:", e)
-        return {}
+        print("Error fetching live workers:", e)
+        return []
 
 
-def get_last_tx(telegram_id):
+def save_poll_state(
+    telegram_id, next_due, last_poll_at, last_result, failures, commit=True
+):
     try:
-        # Select the last_tx for the specified telegram_id
-        cur.execute(
-            "SELECT last_tx FROM bank_users WHERE telegram_id = ?", (telegram_id,)
+        conn = get_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO poll_state "
+            "(telegram_id, next_due, last_poll_at, last_result, failures) VALUES (?, ?, ?, ?, ?)",
+            (telegram_id, next_due, last_poll_at, last_result, failures),
         )
-        result = cur.fetchone()
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error saving poll state:", e)
 
-        if result:
-            (last_tx,) = result
-            return result
-        else:
-            print(f"User with telegram_id {telegram_id} not found.")
-            return None
 
+def delete_poll_state(telegram_id, commit=True):
+    try:
+        conn = get_connection()
+        conn.execute("DELETE FROM poll_state WHERE telegram_id = ?", (telegram_id,))
+        if commit:
+            conn.commit()
     except sq.Error as e:
-        print("Error getting last_tx:", e)
-        return None
+        if not commit:
+            raise
+        print("Error deleting poll state:", e)
 
 
-import sqlite3 as sq
-import json
+def get_poll_states() -> dict:
+    try:
+        rows = get_connection().execute(
+            "SELECT telegram_id, next_due, last_poll_at, failures FROM poll_state"
+        )
+        return {telegram_id: tuple(state) for telegram_id, *state in rows}
+    except sq.Error as e:
+        print("Error fetching poll states:", e)
+        return {}
 
 
-def set_last_tx(telegram_id, last_tx):
+def get_cached(key):
     try:
-        # Update the last_tx for the specified telegram_id
-        cur.execute(
-            "UPDATE bank_users SET last_tx = ? WHERE telegram_id = ?",
-            (last_tx, telegram_id),
+        row = (
+            get_connection()
+            .execute(
+                "SELECT value FROM app_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            )
+            .fetchone()
         )
-        db.commit()
-
-        print(f"Last transaction set for user with telegram_id {telegram_id}")
+        return row[0] if row else None
     except sq.Error as e:
-        print("Error setting last_tx:", e)
+        print("Error reading cache:", e)
+        return None
 
 
-# Usage example
-# Replace 'telegram_id' and 'last_tx_data' with your actual values
-telegram_id = "12345"
-last_tx_data = {"transaction_id": 1, "amount": 100.0, "description": "Payment"}
-set_last_tx(telegram_id, last_tx_data)
+def set_cached(key, value, expires_at, commit=True):
+    try:
+        conn = get_connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO app_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, expires_at),
+        )
+        if commit:
+            conn.commit()
+    except sq.Error as e:
+        if not commit:
+            raise
+        print("Error writing cache:", e)
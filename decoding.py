@@ -0,0 +1,94 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib decoder is the fallback
+    orjson = None
+
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_TRANSACTIONS = re.compile(r'"transactions"\s*:\s*\{')
+_BOOKED = re.compile(r'"booked"\s*:\s*\[')
+_PENDING = re.compile(r'"pending"\s*:\s*\[')
+
+# Below this size a full decode with orjson beats decoding item by item
+PARTIAL_MIN_BYTES = 256 * 1024
+
+
+def loads(data):
+    """Decode a JSON document with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Encode ``obj`` as compact UTF-8 JSON text."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _skip(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _read_array(text: str, pos: int, limit: int = None) -> list:
+    """Decode items of the JSON array whose ``[`` is at ``pos``, at most ``limit``."""
+    items = []
+    pos = _skip(text, pos + 1)
+    if text[pos] == "]":
+        return items
+
+    while limit is None or len(items) < limit:
+        item, pos = _decoder.raw_decode(text, pos)
+        items.append(item)
+        pos = _skip(text, pos)
+        if text[pos] == "]":
+            break
+        if text[pos] != ",":
+            raise ValueError(f"Unexpected {text[pos]!r} at {pos} in transactions array")
+        pos = _skip(text, pos + 1)
+
+    return items
+
+
+def _decode_all(body, limit: int) -> dict:
+    transactions = loads(body)["transactions"]
+    transactions["booked"] = transactions.get("booked", [])[:limit]
+    return transactions
+
+
+def decode_transactions(body, limit: int = None) -> dict:
+    """Decode the ``transactions`` object of a /transactions/ response.
+
+    With ``limit`` only the first ``limit`` booked entries, the most recent
+    ones, are returned. On large responses the rest of the booked array is
+    skipped without being decoded. Pending entries are always decoded.
+    """
+    if limit is None:
+        return loads(body)["transactions"]
+
+    if len(body) < PARTIAL_MIN_BYTES:
+        return _decode_all(body, limit)
+
+    text = body.decode("utf-8") if isinstance(body, (bytes, bytearray)) else body
+
+    # Either array may come first, so both are searched from the object start
+    start = _TRANSACTIONS.search(text)
+    booked_at = start and _BOOKED.search(text, start.end())
+    pending_at = start and _PENDING.search(text, start.end())
+
+    # Anything unexpected falls back to decoding the whole document
+    if not booked_at or not pending_at:
+        return _decode_all(body, limit)
+
+    try:
+        booked = _read_array(text, booked_at.end() - 1, limit)
+        pending = _read_array(text, pending_at.end() - 1)
+    except (ValueError, IndexError):
+        return _decode_all(body, limit)
+
+    return {"booked": booked, "pending": pending}
@@ -0,0 +1,172 @@
+from collections import Counter
+from metrics import Histogram
+from loguru import logger
+import traceback
+import threading
+import asyncio
+import time
+import sys
+import os
+
+
+LOOP_LAG_SECONDS = Histogram(
+    "bankbot_loop_lag_seconds",
+    "How late the event loop ran a timer, sampled by the diagnostics monitor",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def enabled() -> bool:
+    return os.getenv("DIAGNOSTICS", "").lower() in ("1", "true", "yes")
+
+
+def loop_stack(thread_id: int) -> str:
+    frame = sys._current_frames().get(thread_id)
+    return "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+
+
+class LoopMonitor:
+    """Finds code that blocks the event loop.
+
+    A task on the loop records a heartbeat every ``interval`` seconds and the
+    lag of each wake-up. A watchdog thread checks the heartbeat, and when
+    the loop has not run for ``threshold`` seconds it logs the loop thread's
+    current stack, which is the code that is blocking it.
+    """
+
+    def __init__(self, threshold: float = None, interval: float = None):
+        self.threshold = threshold or float(os.getenv("LOOP_BLOCK_THRESHOLD", 0.1))
+        self.interval = interval or float(os.getenv("LOOP_MONITOR_INTERVAL", 0.05))
+        self.blocks = 0
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(f"Event loop monitor started, blocking threshold {self.threshold}s")
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag = self._beat - started - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(max(lag, 0.0))
+            if lag >= self.threshold:
+                logger.warning(f"Event loop was blocked for {lag:.3f}s in total")
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or reported == beat:
+                continue
+
+            # One report per blocking episode, taken while it is still blocked
+            reported = beat
+            self.blocks += 1
+            logger.warning(
+                f"Event loop blocked for {blocked:.3f}s, loop thread stack:\n"
+                f"{loop_stack(self._loop_thread)}"
+            )
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack to show where its time goes.
+
+    Every handler, poll and broadcast runs on the loop thread, so the
+    samples cover all of them. Frames are counted once per sample in which
+    they appear (inclusive) and when they are the innermost frame (self).
+    """
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or float(os.getenv("PROFILE_INTERVAL", 0.005))
+        self.running = False
+
+    def _sample(self, thread_id: int, duration: float) -> tuple:
+        inclusive = Counter()
+        own = Counter()
+        samples = 0
+        deadline = time.monotonic() + duration
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                samples += 1
+                own[self._describe(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    name = self._describe(frame)
+                    if name not in seen:
+                        seen.add(name)
+                        inclusive[name] += 1
+                    frame = frame.f_back
+            time.sleep(self.interval)
+
+        return samples, inclusive, own
+
+    @staticmethod
+    def _describe(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    async def profile(self, duration: float, top: int = 15) -> str:
+        """Sample the current loop thread for ``duration`` seconds and summarise."""
+        if self.running:
+            raise RuntimeError("A profile is already being collected")
+
+        self.running = True
+        try:
+            samples, inclusive, own = await asyncio.get_running_loop().run_in_executor(
+                None, self._sample, threading.get_ident(), duration
+            )
+        finally:
+            self.running = False
+
+        if not samples:
+            return "No samples collected"
+
+        # The loop idling in select() is not interesting time
+        idle = own.pop(
+            next((name for name in own if name.startswith("select ")), ""), 0
+        )
+        lines = [
+            f"{samples} samples over {duration:.0f}s, loop idle {idle / samples:.0%}",
+            "",
+            "Top self time:",
+        ]
+        lines += [
+            f"{count / samples:6.1%}  {name}" for name, count in own.most_common(top)
+        ]
+        lines += ["", "Top bot.py functions (inclusive):"]
+        lines += [
+            f"{count / samples:6.1%}  {name}"
+            for name, count in inclusive.most_common()
+            if "(bot.py:" in name
+        ][:top]
+        return "\n".join(lines)
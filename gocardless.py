@@ -0,0 +1,88 @@
+from metrics import UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+from loguru import logger
+import httpx
+import os
+
+
+BASE_URL = "https://bankaccountdata.gocardless.com/api/v2"
+
+
+class GoCardlessClient:
+    """Shared async HTTP client for the GoCardless Bank Account Data API.
+
+    One pooled connection set is kept alive for the whole bot, so requests
+    reuse TLS sessions instead of opening a new connection every time.
+    """
+
+    def __init__(
+        self,
+        base_url: str = None,
+        timeout: float = None,
+        connect_timeout: float = None,
+        max_connections: int = None,
+        max_keepalive: int = None,
+    ):
+        self.base_url = base_url or os.getenv("GOCARDLESS_BASE_URL", BASE_URL)
+        self.timeout = httpx.Timeout(
+            timeout or float(os.getenv("GOCARDLESS_TIMEOUT", 15)),
+            connect=connect_timeout
+            or float(os.getenv("GOCARDLESS_CONNECT_TIMEOUT", 5)),
+        )
+        # All traffic goes to one host, so the pool limits are the per-host limits
+        self.limits = httpx.Limits(
+            max_connections=max_connections
+            or int(os.getenv("GOCARDLESS_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=max_keepalive
+            or int(os.getenv("GOCARDLESS_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=30,
+        )
+        self._client = None
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                headers={"accept": "application/json"},
+                http2=False,
+            )
+            logger.info(
+                f"GoCardless HTTP client started (max connections {self.limits.max_connections})"
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get(self, path: str, access_token: str, params: dict = None):
+        if self._client is None:
+            await self.start()
+
+        endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+        status = "error"
+        with UPSTREAM_SECONDS.time("gocardless", endpoint):
+            try:
+                response = await self._client.get(
+                    path,
+                    params=params,
+                    headers={"Authorization": f"Bearer {access_token}"},
+                )
+                status = response.status_code
+            finally:
+                UPSTREAM_RESPONSES.inc("gocardless", endpoint, status)
+        return response
+
+    async def get_details(self, account_id: str, access_token: str):
+        return await self.get(f"/accounts/{account_id}/details/", access_token)
+
+    async def get_balances(self, account_id: str, access_token: str):
+        return await self.get(f"/accounts/{account_id}/balances/", access_token)
+
+    async def get_transactions(
+        self, account_id: str, access_token: str, params: dict = None
+    ):
+        return await self.get(
+            f"/accounts/{account_id}/transactions/", access_token, params
+        )
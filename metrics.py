@@ -0,0 +1,240 @@
+from telegram.request import HTTPXRequest
+from bisect import bisect_left
+from loguru import logger
+import threading
+import asyncio
+import time
+import os
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """Cumulative histogram safe to observe from any thread."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels) -> "_Timer":
+        """Context manager observing the time spent in its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            series = [
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._series.items()
+            ]
+
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = _labels(self.labelnames + ("le",), labels + (bound,))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric) -> None:
+        self._metrics.append(metric)
+
+    def add_collector(self, collect) -> None:
+        """Add a callable returning ``(name, kind, help, labels, value)`` samples.
+
+        Collectors are read at scrape time, for values that components
+        already keep themselves such as counters and queue sizes.
+        """
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+
+        described = set()
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.warning(f"Metrics collector {collect} failed: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = Histogram(
+    "bankbot_handler_seconds", "Time spent in a Telegram update handler", ["handler"]
+)
+UPSTREAM_SECONDS = Histogram(
+    "bankbot_upstream_seconds",
+    "Latency of calls to the GoCardless and Telegram APIs",
+    ["service", "endpoint"],
+)
+UPSTREAM_RESPONSES = Counter(
+    "bankbot_upstream_responses_total",
+    "Responses from the GoCardless and Telegram APIs by status",
+    ["service", "endpoint", "status"],
+)
+DB_SECONDS = Histogram(
+    "bankbot_db_seconds", "Duration of SQLite calls and commits", ["call"], DB_BUCKETS
+)
+POLL_LAG_SECONDS = Histogram(
+    "bankbot_poll_lag_seconds", "Delay between a poll's due time and its start"
+)
+
+
+class MeteredRequest(HTTPXRequest):
+    """Bot API transport that records the latency of every method call."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        status = "error"
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            status = code
+            return code, payload
+        finally:
+            UPSTREAM_SECONDS.observe(
+                time.perf_counter() - started, "telegram", endpoint
+            )
+            UPSTREAM_RESPONSES.inc("telegram", endpoint, status)
+
+
+class MetricsServer:
+    """Serves the registry in Prometheus text format at ``/metrics``."""
+
+    def __init__(
+        self, port: int = None, host: str = None, registry: Registry = REGISTRY
+    ):
+        self.port = port or int(os.getenv("METRICS_PORT", 0))
+        self.host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+        self.registry = registry
+        self._server = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.port)
+
+    async def start(self) -> None:
+        if self.enabled and self._server is None:
+            self._server = await asyncio.start_server(self._serve, self.host, self.port)
+            logger.info(f"Metrics served at http://{self.host}:{self.port}/metrics")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader, writer) -> None:
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,225 @@
+from telegram.ext import BaseRateLimiter
+from telegram.error import RetryAfter
+from collections import deque
+from itertools import islice
+from metrics import REGISTRY, Histogram
+from ratelimit import TokenBucket
+from loguru import logger
+import asyncio
+import time
+import os
+
+
+INTERACTIVE, NOTIFICATION, BROADCAST = 0, 1, 2
+LANES = ("interactive", "notification", "broadcast")
+
+OUTBOUND_WAIT_SECONDS = Histogram(
+    "bankbot_outbound_wait_seconds",
+    "Time a Telegram message waited in the outbound queue",
+    ["lane"],
+)
+
+
+class OutboundDispatcher(BaseRateLimiter):
+    """Single outbound queue for every message the bot sends to a chat.
+
+    Requests wait in one of three lanes and are let through by one
+    dispatcher task, interactive replies first, then transaction
+    notifications, then broadcasts. Each release takes a token from the
+    global bucket, and messages to a group or channel also take one from
+    that chat's bucket, as Telegram limits those to 20 a minute. Private
+    chats only share the global limit, so replies are not slowed down.
+    Only the first ``SCAN_DEPTH`` entries of a lane are considered, so a
+    group that is out of tokens does not hold back the rest of its lane.
+    A RetryAfter from Telegram pauses the global bucket, and the request
+    is retried.
+
+    Pass ``rate_limit_args={"priority": NOTIFICATION}`` or ``BROADCAST`` to
+    a bot method to use a lower lane. Requests without a priority are
+    interactive.
+    """
+
+    SCAN_DEPTH = 64
+
+    def __init__(
+        self,
+        rate: float = None,
+        group_rate: float = None,
+        group_burst: float = None,
+        max_retries: int = None,
+    ):
+        self.bucket = TokenBucket(rate or float(os.getenv("TELEGRAM_RATE", 30)))
+        # Per second, configured per minute like Telegram documents it
+        self.group_rate = group_rate or float(os.getenv("TELEGRAM_GROUP_RATE", 20)) / 60
+        self.group_burst = group_burst or float(os.getenv("TELEGRAM_GROUP_BURST", 20))
+        self.max_retries = (
+            max_retries
+            if max_retries is not None
+            else int(os.getenv("TELEGRAM_MAX_RETRIES", 3))
+        )
+
+        self._lanes = [deque() for _ in LANES]
+        self._chats = {}
+        self._prune_at = 10000
+        self._wakeup = None
+        self._task = None
+
+        self.sent = [0] * len(LANES)
+        self.retry_after_count = 0
+        REGISTRY.add_collector(self.collect_metrics)
+
+    async def initialize(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for lane in self._lanes:
+            while lane:
+                lane.popleft()[2].cancel()
+
+    def depth(self, lane: int) -> int:
+        return sum(1 for _, _, future in self._lanes[lane] if not future.done())
+
+    def collect_metrics(self):
+        depth = ("bankbot_outbound_queue_depth", "gauge", "Messages waiting to be sent")
+        sent = ("bankbot_outbound_sent_total", "counter", "Messages let through")
+        for lane, name in enumerate(LANES):
+            yield (*depth, {"lane": name}, self.depth(lane))
+            yield (*sent, {"lane": name}, self.sent[lane])
+        yield (
+            "bankbot_outbound_retry_after_total",
+            "counter",
+            "Flood control responses from Telegram",
+            {},
+            self.retry_after_count,
+        )
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        chat_id = data.get("chat_id")
+        if chat_id is None or self._task is None:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", INTERACTIVE)
+        retries = 0
+
+        while True:
+            await self._admit(priority, chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                # Flood control applies to the whole bot, so every lane waits
+                self.bucket.pause(float(e.retry_after))
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                logger.warning(
+                    f"Telegram flood limit on {endpoint} to {chat_id}, retrying in {e.retry_after}s"
+                )
+
+    async def _admit(self, priority: int, chat_id) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append((chat_id, time.monotonic(), future))
+        self._wakeup.set()
+        await future
+
+    async def _run(self) -> None:
+        while True:
+            wait = self._release_next()
+            if wait == 0:
+                continue
+
+            self._wakeup.clear()
+            if wait is None:
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _release_next(self):
+        """Let the next request through.
+
+        Returns 0 after releasing one, otherwise the seconds until one could
+        be released, or None when nothing is waiting.
+        """
+        now = time.monotonic()
+        global_wait = self.bucket.delay()
+        soonest = None
+
+        for priority, lane in enumerate(self._lanes):
+            # Requests whose caller gave up are dropped from the head
+            while lane and lane[0][2].done():
+                lane.popleft()
+
+            for index, (chat_id, queued_at, future) in enumerate(
+                islice(lane, self.SCAN_DEPTH)
+            ):
+                if future.done():
+                    continue
+
+                chat_wait = self._chat_delay(chat_id, now)
+                if chat_wait > 0:
+                    soonest = chat_wait if soonest is None else min(soonest, chat_wait)
+                    continue
+
+                if global_wait > 0 or not self.bucket.try_acquire():
+                    # Highest priority ready request waits for the global bucket
+                    return max(global_wait, 1e-3)
+
+                del lane[index]
+                self._take_chat_token(chat_id, now)
+                self.sent[priority] += 1
+                OUTBOUND_WAIT_SECONDS.observe(now - queued_at, LANES[priority])
+                future.set_result(None)
+                return 0
+
+        return soonest
+
+    @staticmethod
+    def is_group(chat_id) -> bool:
+        # Groups and channels have negative ids, channels may also use @username
+        try:
+            return int(chat_id) < 0
+        except ValueError:
+            return True
+
+    def _chat_tokens(self, chat_id, now: float) -> float:
+        state = self._chats.get(chat_id)
+        if state is None:
+            return self.group_burst
+        tokens, updated = state
+        return min(self.group_burst, tokens + (now - updated) * self.group_rate)
+
+    def _chat_delay(self, chat_id, now: float) -> float:
+        if not self.is_group(chat_id):
+            return 0.0
+        tokens = self._chat_tokens(chat_id, now)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.group_rate
+
+    def _take_chat_token(self, chat_id, now: float) -> None:
+        if not self.is_group(chat_id):
+            return
+        self._chats[chat_id] = (self._chat_tokens(chat_id, now) - 1, now)
+
+        if len(self._chats) > self._prune_at:
+            # Chats that refilled completely behave like new ones
+            full = self.group_burst / self.group_rate
+            self._chats = {
+                chat: state
+                for chat, state in self._chats.items()
+                if now - state[1] < full
+            }
+            self._prune_at = max(10000, 2 * len(self._chats))
@@ -0,0 +1,230 @@
+from datetime import datetime, timedelta, timezone
+from math import ceil
+from loguru import logger
+import database as db
+import time
+import os
+
+
+LIMIT_HEADERS = (
+    "HTTP_X_RATELIMIT_ACCOUNT_SUCCESS_LIMIT",
+    "X-RateLimit-Account-Success-Limit",
+)
+REMAINING_HEADERS = (
+    "HTTP_X_RATELIMIT_ACCOUNT_SUCCESS_REMAINING",
+    "X-RateLimit-Account-Success-Remaining",
+)
+RESET_HEADERS = (
+    "HTTP_X_RATELIMIT_ACCOUNT_SUCCESS_RESET",
+    "X-RateLimit-Account-Success-Reset",
+)
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, account_id: str, endpoint: str, retry_at: float):
+        super().__init__(f"Quota for {endpoint} of account {account_id} is used up")
+        self.account_id = account_id
+        self.endpoint = endpoint
+        self.retry_at = retry_at
+
+
+def _header(response, names):
+    for name in names:
+        value = response.headers.get(name)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                return None
+    return None
+
+
+def _call(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def _next_utc_midnight(now: float) -> float:
+    today = datetime.fromtimestamp(now, timezone.utc).date()
+    midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+    return midnight.replace(tzinfo=timezone.utc).timestamp()
+
+
+class QuotaBudget:
+    """Per-account daily request budget for the GoCardless data endpoints.
+
+    The limit and remaining calls are taken from the rate-limit response
+    headers and kept in the ``api_quota`` table. Background polls are spread
+    evenly over the time left until the quota resets, and a share of the
+    quota is kept back for requests the user makes from the keyboard.
+
+    With ``POLL_MODE=workers`` the bot and the poll workers spend the same
+    budget, so it is read from the table again before every decision and
+    saved column by column.
+    """
+
+    def __init__(
+        self, daily_limit: int = None, interactive_share: float = None, storage=None
+    ):
+        self.storage = storage
+        daily_limit = daily_limit or os.getenv("QUOTA_DAILY_LIMIT")
+        self.daily_limit = int(daily_limit) if daily_limit else None
+        self.interactive_share = (
+            interactive_share
+            if interactive_share is not None
+            else float(os.getenv("QUOTA_INTERACTIVE_SHARE", 0.25))
+        )
+        self.shared = os.getenv("POLL_MODE", "local") == "workers"
+        self._state = {}
+
+    async def load(self, account_id: str, endpoint: str) -> None:
+        """Read the stored budget of ``endpoint`` without blocking the event loop."""
+        key = (account_id, endpoint)
+        if self.storage is None or (key in self._state and not self.shared):
+            return
+
+        row = await self.storage.read(db.get_quota, account_id, endpoint)
+        if self.shared:
+            self._state[key] = self._from_row(row)
+        else:
+            self._state.setdefault(key, self._from_row(row))
+
+    def _from_row(self, row) -> dict:
+        if row is not None:
+            (
+                limit,
+                remaining,
+                reset_at,
+                retry_after_until,
+                interactive_used,
+                last_poll_at,
+            ) = row
+        else:
+            limit, remaining, reset_at = self.daily_limit, self.daily_limit, None
+            retry_after_until, interactive_used, last_poll_at = 0.0, 0, 0.0
+        return {
+            "limit": limit,
+            "remaining": remaining,
+            "reset_at": reset_at,
+            "retry_after_until": retry_after_until or 0.0,
+            "interactive_used": interactive_used or 0,
+            "last_poll_at": last_poll_at or 0.0,
+        }
+
+    def _get(self, account_id: str, endpoint: str) -> dict:
+        key = (account_id, endpoint)
+        state = self._state.get(key)
+
+        if state is None:
+            state = self._state[key] = self._from_row(
+                db.get_quota(account_id, endpoint)
+            )
+
+        now = time.time()
+        if state["reset_at"] is not None and now >= state["reset_at"]:
+            state["remaining"] = state["limit"]
+            state["reset_at"] = None
+            state["interactive_used"] = 0
+            self._save(
+                account_id,
+                endpoint,
+                {"remaining": state["limit"], "reset_at": None, "interactive_used": 0},
+            )
+
+        return state
+
+    def _save(self, account_id: str, endpoint: str, values: dict, **counts) -> None:
+        save = self.storage.write if self.storage is not None else _call
+        save(
+            db.update_quota,
+            account_id,
+            endpoint,
+            values,
+            day_limit=self.daily_limit,
+            **counts,
+        )
+
+    def _reserve_left(self, state: dict) -> int:
+        reserve = ceil(state["limit"] * self.interactive_share)
+        return max(0, reserve - state["interactive_used"])
+
+    def next_poll_at(self, account_id: str, endpoint: str = "transactions") -> float:
+        """Earliest time a background poll of ``endpoint`` fits the budget."""
+        state = self._get(account_id, endpoint)
+        now = time.time()
+
+        if now < state["retry_after_until"]:
+            return state["retry_after_until"]
+
+        if state["limit"] is None or state["remaining"] is None:
+            return now
+
+        reset_at = state["reset_at"] or _next_utc_midnight(now)
+        poll_budget = state["remaining"] - self._reserve_left(state)
+
+        if poll_budget <= 0:
+            return reset_at
+
+        return state["last_poll_at"] + (reset_at - now) / poll_budget
+
+    def can_poll(self, account_id: str, endpoint: str = "transactions") -> bool:
+        return self.next_poll_at(account_id, endpoint) <= time.time()
+
+    def check(self, account_id: str, endpoint: str, interactive: bool) -> None:
+        """Raise ``QuotaExceeded`` if a call to ``endpoint`` must not be made now."""
+        if not interactive:
+            retry_at = self.next_poll_at(account_id, endpoint)
+            if retry_at > time.time():
+                raise QuotaExceeded(account_id, endpoint, retry_at)
+            return
+
+        state = self._get(account_id, endpoint)
+        now = time.time()
+
+        if now < state["retry_after_until"]:
+            raise QuotaExceeded(account_id, endpoint, state["retry_after_until"])
+
+        if state["remaining"] is not None and state["remaining"] <= 0:
+            raise QuotaExceeded(
+                account_id, endpoint, state["reset_at"] or _next_utc_midnight(now)
+            )
+
+    def record(
+        self, account_id: str, endpoint: str, response, interactive: bool
+    ) -> None:
+        """Update the budget from a response of ``endpoint``."""
+        state = self._get(account_id, endpoint)
+        now = time.time()
+
+        limit = _header(response, LIMIT_HEADERS)
+        remaining = _header(response, REMAINING_HEADERS)
+        reset = _header(response, RESET_HEADERS)
+        values = {}
+        spent = False
+
+        if limit is not None:
+            state["limit"] = values["day_limit"] = limit
+        if remaining is not None:
+            state["remaining"] = values["remaining"] = remaining
+        elif state["remaining"] is not None and response.status_code < 400:
+            state["remaining"] = max(0, state["remaining"] - 1)
+            spent = True
+        if reset is not None:
+            state["reset_at"] = values["reset_at"] = now + reset
+
+        if response.status_code == 429:
+            retry_after = _header(response, ("Retry-After",))
+            if retry_after is None:
+                retry_after = reset if reset is not None else 3600
+            state["retry_after_until"] = values["retry_after_until"] = now + retry_after
+            state["remaining"] = values["remaining"] = 0
+            spent = False
+            logger.warning(
+                f"Rate limited on {endpoint} of account {account_id} for {retry_after}s"
+            )
+
+        if interactive:
+            state["interactive_used"] += 1
+        else:
+            state["last_poll_at"] = values["last_poll_at"] = now
+
+        self._save(account_id, endpoint, values, spent=spent, interactive=interactive)
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket allowing ``rate`` acquisitions per second.
+
+    Up to ``capacity`` tokens can be spent in a burst. ``pause`` stops all
+    acquisitions for a while, e.g. after Telegram answers with RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """Seconds until a token will be available."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self._paused_until - now)
+        if self._tokens < 1:
+            wait = max(wait, (1 - self._tokens) / self.rate)
+        return wait
+
+    async def acquire(self) -> None:
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep(self.delay())
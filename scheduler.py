@@ -0,0 +1,287 @@
+from metrics import POLL_LAG_SECONDS
+from random import uniform
+from loguru import logger
+import database as db
+import asyncio
+import heapq
+import time
+import os
+
+
+class PollScheduler:
+    """Owns the transaction polling of every subscribed user.
+
+    Users sit in one heap keyed by their next due time, so adding, removing
+    and finding the next due user stays O(log n) however many subscribers
+    there are. A single dispatcher task pops due users in batches and runs
+    their polls under a global concurrency limit. ``poll`` may return the
+    seconds until the user's next poll, otherwise a random interval between
+    ``min_interval`` and ``max_interval`` is used.
+
+    With a ``storage``, each user's next due time, last result and failure
+    count are saved after every poll, and ``restore`` schedules users on
+    that saved timetable after a restart. A user whose polls keep failing
+    waits twice as long after every failure, up to ``backoff_max``.
+    """
+
+    def __init__(
+        self,
+        poll,
+        min_interval: float = None,
+        max_interval: float = None,
+        concurrency: int = None,
+        batch_size: int = None,
+        storage=None,
+    ):
+        self.poll = poll
+        self.storage = storage
+        self.min_interval = min_interval or float(os.getenv("POLL_INTERVAL_MIN", 60))
+        self.max_interval = max_interval or float(os.getenv("POLL_INTERVAL_MAX", 120))
+        self.concurrency = concurrency or int(os.getenv("POLL_CONCURRENCY", 20))
+        self.batch_size = batch_size or int(os.getenv("POLL_BATCH_SIZE", 100))
+        self.backoff_max = float(os.getenv("POLL_BACKOFF_MAX", 3600))
+        self.drain_timeout = float(os.getenv("POLL_DRAIN_TIMEOUT", 10))
+
+        self._heap = []
+        self._entries = {}
+        self._seq = 0
+        self._failures = {}
+        self._in_flight = set()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = None
+
+        self.polls = 0
+        self.failures = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def next_interval(self) -> float:
+        return uniform(self.min_interval, self.max_interval)
+
+    def backoff_interval(self, failures: int) -> float:
+        if not failures:
+            return self.next_interval()
+        return min(self.next_interval() * 2 ** min(failures, 16), self.backoff_max)
+
+    def add(self, user_id, delay: float = None) -> None:
+        """Schedule ``user_id``, replacing any existing schedule."""
+        if delay is None:
+            delay = self.next_interval()
+        self._push(user_id, time.monotonic() + delay)
+
+    def add_many(self, user_ids, spread: float = None, states: dict = None) -> int:
+        """Schedule users that are not scheduled yet in one heap rebuild.
+
+        ``states`` maps users to their saved ``(next_due, last_poll_at,
+        failures)``, with wall clock times. A user keeps a saved due time
+        that is still ahead. An overdue user's due time is moved forward by
+        whole multiples of their own last interval, ``next_due -
+        last_poll_at``, which keeps the phase of their timetable and so
+        spreads overdue users as evenly as before the downtime.
+        Users without state get a random first delay of up to ``spread``
+        seconds, by default the longest poll interval. Returns how many
+        users were added.
+        """
+        spread = self.max_interval if spread is None else spread
+        states = states or {}
+        now = time.monotonic()
+        # Saved due times are wall clock, the heap runs on the monotonic clock
+        offset = now - time.time()
+        period = (self.min_interval + self.max_interval) / 2
+        due_times = {}
+
+        for user_id in user_ids:
+            if user_id in self._entries or user_id in due_times:
+                continue
+            state = states.get(user_id)
+            if state is None:
+                due_times[user_id] = now + uniform(0, spread)
+                continue
+
+            next_due, last_poll_at, failures = state
+            if failures:
+                self._failures[user_id] = failures
+            due = next_due + offset
+            if due <= now:
+                # Skip the polls missed while down, keeping the same phase
+                interval = next_due - (last_poll_at or next_due)
+                if interval <= 0:
+                    interval = period
+                due += interval * ((now - due) // interval + 1)
+            due_times[user_id] = due
+
+        for user_id, due in due_times.items():
+            self._seq += 1
+            self._entries[user_id] = self._seq
+            self._heap.append((due, self._seq, user_id))
+
+        added = len(due_times)
+
+        if added:
+            heapq.heapify(self._heap)
+            self._wakeup.set()
+        return added
+
+    async def restore(self, user_ids) -> int:
+        """Schedule users that are not scheduled yet on their saved timetable."""
+        user_ids = [user_id for user_id in user_ids if user_id not in self._entries]
+        if not user_ids:
+            return 0
+
+        states = None
+        if self.storage is not None:
+            states = await self.storage.read(db.get_poll_states)
+        return self.add_many(user_ids, states=states)
+
+    def remove(self, user_id, forget: bool = False) -> bool:
+        """Unschedule ``user_id``. Returns whether it was scheduled.
+
+        Pass ``forget`` when the user unsubscribed, to also delete their
+        saved state. A user moving to another worker keeps it.
+        """
+        self._failures.pop(user_id, None)
+        if forget and self.storage is not None:
+            self.storage.write(db.delete_poll_state, user_id)
+        # The heap entry is dropped lazily when it comes due
+        return self._entries.pop(user_id, None) is not None
+
+    def _push(self, user_id, due: float) -> None:
+        self._seq += 1
+        self._entries[user_id] = self._seq
+        heapq.heappush(self._heap, (due, self._seq, user_id))
+        if self._heap[0][1] == self._seq:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "polls": self.polls,
+            "failures": self.failures,
+            "backing_off": len(self._failures),
+            "last_lag": round(self.last_lag, 3),
+            "max_lag": round(self.max_lag, 3),
+            "avg_lag": round(self._lag_total / self.polls, 3) if self.polls else 0.0,
+        }
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Poll scheduler started with {len(self)} users, concurrency {self.concurrency}"
+            )
+
+    async def stop(self, timeout: float = None) -> None:
+        """Stop starting polls and give running ones ``timeout`` seconds to finish.
+
+        Polls still running after that are cancelled. Their saved state is
+        left as it was, so they run again soon after a restart.
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if not self._in_flight:
+            return
+
+        logger.info(
+            f"Waiting up to {timeout}s for {len(self._in_flight)} polls to finish"
+        )
+        _, pending = await asyncio.wait(list(self._in_flight), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.warning(
+                f"Cancelled {len(pending)} polls that did not finish in time"
+            )
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+
+            while self._heap and self._heap[0][1] != self._entries.get(
+                self._heap[0][2]
+            ):
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.monotonic()
+            batch = []
+            while (
+                self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size
+            ):
+                due, seq, user_id = heapq.heappop(self._heap)
+                if self._entries.get(user_id) == seq:
+                    batch.append((user_id, seq, due))
+
+            for user_id, seq, due in batch:
+                await self._semaphore.acquire()
+                task = asyncio.create_task(self._poll_user(user_id, seq, due))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+
+    async def _poll_user(self, user_id, seq: int, due: float) -> None:
+        lag = time.monotonic() - due
+        self.polls += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+        POLL_LAG_SECONDS.observe(lag)
+
+        if self.polls % 1000 == 0:
+            logger.info(f"Poll scheduler stats: {self.stats()}")
+
+        delay = None
+        result = "ok"
+        try:
+            delay = await self.poll(user_id)
+            self._failures.pop(user_id, None)
+        except Exception as e:
+            self.failures += 1
+            self._failures[user_id] = self._failures.get(user_id, 0) + 1
+            result = repr(e)[:200]
+            logger.exception(f"Polling transactions for {user_id} failed: {e}")
+        finally:
+            self._semaphore.release()
+
+        # Reschedule unless the user was removed or re-added meanwhile
+        if self._entries.get(user_id) == seq:
+            failures = self._failures.get(user_id, 0)
+            if delay is None or failures:
+                delay = self.backoff_interval(failures)
+            self._push(user_id, time.monotonic() + delay)
+
+            if self.storage is not None:
+                now = time.time()
+                self.storage.write(
+                    db.save_poll_state, user_id, now + delay, now, result, failures
+                )
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from nordigen import NordigenClient
+from metrics import UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+from functools import partial
+from loguru import logger
+import threading
+import asyncio
+import os
+
+
+class SdkPool:
+    """Runs blocking NordigenClient calls on a bounded thread pool.
+
+    The SDK is built on ``requests``, so every call blocks. Running it on a
+    small pool keeps the event loop free for other users' updates.
+    """
+
+    def __init__(self, client: NordigenClient, max_workers: int = None):
+        self.client = client
+        self.max_workers = max_workers or int(os.getenv("SDK_POOL_SIZE", 8))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="nordigen"
+        )
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Calls waiting for a free worker thread."""
+        with self._lock:
+            return self.submitted - self.completed - self.failed - self.active
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.submitted - self.completed - self.failed - self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def _call(self, func, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+        try:
+            with UPSTREAM_SECONDS.time("gocardless_sdk", func.__name__):
+                result = func(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.active -= 1
+                self.failed += 1
+            UPSTREAM_RESPONSES.inc("gocardless_sdk", func.__name__, "error")
+            raise
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+        UPSTREAM_RESPONSES.inc("gocardless_sdk", func.__name__, "ok")
+        return result
+
+    async def run(self, func, *args, **kwargs):
+        with self._lock:
+            self.submitted += 1
+        queued = self.queue_depth
+        if queued >= self.max_workers:
+            logger.warning(f"Nordigen pool is saturated, {queued} calls waiting")
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(self._call, func, *args, **kwargs)
+        )
+
+    async def initialize_session(self, **kwargs):
+        return await self.run(self.client.initialize_session, **kwargs)
+
+    async def get_requisition_by_id(self, requisition_id: str) -> dict:
+        return await self.run(
+            self.client.requisition.get_requisition_by_id,
+            requisition_id=requisition_id,
+        )
+
+    async def generate_token(self) -> dict:
+        return await self.run(self.client.generate_token)
+
+    async def exchange_token(self, refresh_token: str) -> dict:
+        return await self.run(self.client.exchange_token, refresh_token)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
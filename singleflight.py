@@ -0,0 +1,38 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the call, and everyone who asks for the
+    same key before it finishes awaits that same result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._calls.get(key)
+
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+
+        # One caller being cancelled must not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved when every waiter has gone away
+            task.exception()
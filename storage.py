@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor
+from metrics import DB_SECONDS
+from functools import partial
+from loguru import logger
+import database as db
+import asyncio
+import os
+
+
+class Storage:
+    """Async facade over the ``database`` module.
+
+    Reads run concurrently on a small thread pool, each thread with its own
+    WAL connection. Writes are queued to a single writer that applies them
+    in batches and commits each batch once, so a burst of updates costs one
+    fsync instead of one per row. ``write`` returns a future that resolves
+    when the write is committed, for callers that need durability.
+    """
+
+    def __init__(
+        self,
+        read_workers: int = None,
+        flush_interval: float = None,
+        max_batch: int = None,
+    ):
+        self.read_workers = read_workers or int(os.getenv("DB_READ_WORKERS", 4))
+        self.flush_interval = (
+            flush_interval
+            if flush_interval is not None
+            else float(os.getenv("DB_FLUSH_INTERVAL", 0.05))
+        )
+        self.max_batch = max_batch or int(os.getenv("DB_MAX_BATCH", 500))
+
+        self._readers = ThreadPoolExecutor(
+            max_workers=self.read_workers, thread_name_prefix="db-read"
+        )
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        self._queue = None
+        self._task = None
+
+        self.commits = 0
+        self.writes = 0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run_writer())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            await self.flush()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+
+    async def read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, partial(_timed, func, *args, **kwargs)
+        )
+
+    async def get_user(self, telegram_id):
+        """Return a user record, going to the database only on a cache miss."""
+        user = db.users.get(telegram_id)
+        if user is None:
+            user = await self.read(db.load_user, telegram_id)
+        return user
+
+    def write(self, func, *args, **kwargs) -> asyncio.Future:
+        """Queue ``func(*args, **kwargs, commit=False)`` for the writer.
+
+        The returned future may be ignored for fire-and-forget writes or
+        awaited to wait until the write is committed.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((partial(func, *args, **kwargs), future))
+        return future
+
+    async def flush(self) -> None:
+        """Wait until everything queued so far is committed."""
+        await self.write(_noop)
+
+    async def _run_writer(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(self._writer, _apply_batch, batch)
+            except Exception as e:
+                # The batch was rolled back, so none of its writes happened
+                logger.error(f"Database commit of {len(batch)} writes failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                        future.exception()
+                continue
+
+            self.writes += len(batch)
+            self.commits += 1
+
+            for (_, future), (result, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                    # Fire-and-forget writes never retrieve it, so log it here
+                    logger.error(f"Database write failed: {error}")
+                    future.exception()
+                else:
+                    future.set_result(result)
+
+
+def _noop(commit=True):
+    return None
+
+
+def _timed(func, *args, **kwargs):
+    with DB_SECONDS.time(getattr(func, "__name__", "call")):
+        return func(*args, **kwargs)
+
+
+def _apply_batch(batch) -> list:
+    results = []
+    for call, _ in batch:
+        try:
+            result = _timed(call.func, *call.args, commit=False, **call.keywords)
+            results.append((result, None))
+        except Exception as e:
+            results.append((None, e))
+    conn = db.get_connection()
+    try:
+        with DB_SECONDS.time("commit"):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        db.users.rolled_back()
+        raise
+    db.users.committed()
+    return results
@@ -0,0 +1,119 @@
+from requests import HTTPError
+from sdk_pool import SdkPool
+from loguru import logger
+import asyncio
+import time
+import os
+
+
+class TokenManager:
+    """Keeps the GoCardless access token fresh.
+
+    Expiry is tracked from the token payload, the access token is renewed
+    with the refresh token shortly before it runs out, and concurrent callers
+    share a single in-flight refresh. ``on_change`` is called with a
+    snapshot after every renewal so the tokens can be saved and restored
+    on the next start.
+    """
+
+    def __init__(self, sdk: SdkPool, margin: float = None, on_change=None):
+        self.sdk = sdk
+        self.on_change = on_change
+        self.margin = margin or float(os.getenv("TOKEN_REFRESH_MARGIN", 300))
+        self.access_token = None
+        self.refresh_token = None
+        self.access_expires_at = 0.0
+        self.refresh_expires_at = 0.0
+        self._refreshing = None
+        self.refresh_count = 0
+        self.full_auth_count = 0
+
+    def set(self, token: dict, obtained_at: float = None) -> None:
+        obtained_at = obtained_at or time.time()
+
+        self.access_token = token["access"]
+        self.access_expires_at = obtained_at + token.get("access_expires", 0)
+
+        # A refresh exchange only returns a new access token
+        if "refresh" in token:
+            self.refresh_token = token["refresh"]
+            self.refresh_expires_at = obtained_at + token.get("refresh_expires", 0)
+
+        self.sdk.client.token = self.access_token
+
+    def snapshot(self) -> dict:
+        return {
+            "access": self.access_token,
+            "access_expires_at": self.access_expires_at,
+            "refresh": self.refresh_token,
+            "refresh_expires_at": self.refresh_expires_at,
+        }
+
+    def restore(self, state: dict) -> bool:
+        """Load a snapshot unless its refresh token is about to expire.
+
+        The tokens are not checked with GoCardless here. A revoked access
+        token is replaced the first time a request is rejected with it.
+        """
+        if time.time() >= state.get("refresh_expires_at", 0) - self.margin:
+            return False
+
+        self.access_token = state["access"]
+        self.access_expires_at = state["access_expires_at"]
+        self.refresh_token = state["refresh"]
+        self.refresh_expires_at = state["refresh_expires_at"]
+        self.sdk.client.token = self.access_token
+        return True
+
+    def access_valid(self) -> bool:
+        return self.access_token is not None and time.time() < self.access_expires_at
+
+    async def access(self) -> str:
+        """Return a usable access token, refreshing it only when needed."""
+        if not self.access_valid():
+            return await self.refresh()
+
+        if time.time() >= self.access_expires_at - self.margin:
+            # Still valid: renew in the background and answer right away
+            self._start_refresh()
+
+        return self.access_token
+
+    async def refresh(self, stale: str = None) -> str:
+        """Refresh the access token once for all concurrent callers.
+
+        Pass the token that was rejected as ``stale``. If another caller has
+        already replaced it, the new token is returned without another call.
+        """
+        if stale is not None and stale != self.access_token and self.access_valid():
+            return self.access_token
+
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._do_refresh())
+        return self._refreshing
+
+    async def _do_refresh(self) -> str:
+        now = time.time()
+
+        if self.refresh_token and now < self.refresh_expires_at - self.margin:
+            try:
+                self.set(await self.sdk.exchange_token(self.refresh_token), now)
+                self.refresh_count += 1
+                logger.info("Access token refreshed with refresh token")
+                self._changed()
+                return self.access_token
+            except HTTPError as e:
+                logger.warning(f"Refresh token was rejected, re-authenticating: {e}")
+
+        logger.warning("Tokens are expired, getting new tokens...")
+        self.set(await self.sdk.generate_token(), now)
+        self.full_auth_count += 1
+        self._changed()
+        return self.access_token
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self.snapshot())
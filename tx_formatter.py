@@ -0,0 +1,130 @@
+from datetime import datetime
+import re
+
+
+# Every character MarkdownV2 requires to be escaped outside of entities
+MARKDOWN_V2_SPECIAL = "\\_*[]()~`>#+-=|{}.!"
+
+_ESCAPE_TABLE = str.maketrans({char: "\\" + char for char in MARKDOWN_V2_SPECIAL})
+
+_DATE_FORMAT = "%d\\.%m\\.%Y ⌛ %H:%M"
+
+# Telegram's text limit, counted in UTF-16 code units like the Bot API does
+MESSAGE_LIMIT = 4096
+SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+# One search over the remittance text classifies it and captures the payee
+_CLASSIFY = re.compile(
+    r"Överföring\s*(?P<transfer>.*)"
+    r"|Kortköp\s*(?:\d{6}\s*)?(?P<card>.*)"
+    r"|(?P<salary>Lön)",
+    re.DOTALL,
+)
+_SERVICE_PAYEE = re.compile(r"\s*(?:Betalning\s*)?(?P<payee>.*)", re.DOTALL)
+
+_TITLES = {
+    "transfer_out": "🔄 " + "#Transfer  to ".translate(_ESCAPE_TABLE),
+    "transfer_in": "🔄 " + "#Transfer  from ".translate(_ESCAPE_TABLE),
+    "card": "💳 " + "#CardPayment  to ".translate(_ESCAPE_TABLE),
+    "salary": "💰 " + "#MonthlySalary".translate(_ESCAPE_TABLE),
+    "service": "🏦 " + "#ServicePayment  to ".translate(_ESCAPE_TABLE),
+}
+
+
+def escape(text: str) -> str:
+    """Escape ``text`` for Telegram MarkdownV2."""
+    return text.translate(_ESCAPE_TABLE)
+
+
+def parse_timestamp(tx_dict: dict) -> datetime:
+    """Parse Nordea's ``YYYY-MM-DD-HH.MM.SS.ffffff`` transactionId once."""
+    tx_id = tx_dict.get("transactionId") or ""
+    try:
+        return datetime(
+            int(tx_id[0:4]),
+            int(tx_id[5:7]),
+            int(tx_id[8:10]),
+            int(tx_id[11:13]),
+            int(tx_id[14:16]),
+            int(tx_id[17:19]),
+            int(tx_id[20:26] or 0),
+        )
+    except ValueError:
+        date = tx_dict.get("bookingDate") or tx_dict.get("valueDate")
+        return datetime.strptime(date, "%Y-%m-%d")
+
+
+def describe(remittance: str, amount: float) -> str:
+    """Return the escaped title line of a transaction."""
+    text = remittance.strip("*")
+    match = _CLASSIFY.search(text)
+
+    if match is None:
+        payee = _SERVICE_PAYEE.match(text).group("payee")
+        return _TITLES["service"] + escape(payee)
+
+    kind = match.lastgroup
+    if kind == "salary":
+        return _TITLES["salary"]
+    if kind == "transfer":
+        title = _TITLES["transfer_out" if amount < 0 else "transfer_in"]
+        return title + escape(match.group("transfer"))
+    return _TITLES["card"] + escape(match.group("card").replace("*", ""))
+
+
+def format_transaction(tx_dict: dict) -> tuple:
+    """Return the MarkdownV2 message of a transaction and its timestamp."""
+    amount = float(tx_dict["transactionAmount"]["amount"])
+    timestamp = parse_timestamp(tx_dict)
+
+    if amount < 0:
+        amount_text = f"*{escape(str(-amount))}* SEK"
+    else:
+        amount_text = f"{escape(str(amount))} SEK"
+
+    message = (
+        f"{describe(tx_dict.get('remittanceInformationUnstructured') or '', amount)}"
+        f"\n\n💵 Amount: {amount_text}"
+        f"\n\n🗓️ Date: {timestamp.strftime(_DATE_FORMAT)}"
+    )
+    return message, timestamp
+
+
+def format_batch(transactions) -> list:
+    """Format many transactions, oldest first."""
+    formatted = [format_transaction(tx_dict) for tx_dict in transactions]
+    formatted.sort(key=lambda item: item[1])
+    return [message for message, _ in formatted]
+
+
+def _length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def pack(messages, header: str = "", limit: int = MESSAGE_LIMIT) -> list:
+    """Join formatted transactions into as few messages as fit in ``limit``.
+
+    ``header`` starts every message and must already be escaped. Messages
+    keep their order and are never split, so one that is too long on its
+    own is sent alone.
+    """
+    packed = []
+    current = None
+    size = 0
+    separator = _length(SEPARATOR)
+
+    for message in messages:
+        length = _length(message)
+        if current is not None and size + separator + length <= limit:
+            current.append(message)
+            size += separator + length
+            continue
+
+        if current is not None:
+            packed.append(header + SEPARATOR.join(current))
+        current = [message]
+        size = _length(header) + length
+
+    if current is not None:
+        packed.append(header + SEPARATOR.join(current))
+    return packed
@@ -0,0 +1,62 @@
+from telegram.ext import BaseUpdateProcessor
+from telegram import Update
+import asyncio
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's in order.
+
+    Updates from different users run in parallel up to
+    ``max_concurrent_updates``. Updates from the same user wait on that
+    user's lock, which asyncio hands out first come first served, so a
+    user's messages are still handled in the order they arrived. Only the
+    update holding a user's lock competes for a concurrency slot. That is
+    what ConversationHandler and the settings keyboards rely on.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._pending = {}
+
+    @staticmethod
+    def ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine) -> None:
+        # Replaces the base method, which takes a concurrency slot first. Here
+        # an update waits for the user's earlier ones before it takes a slot,
+        # so a user's queued updates do not hold slots other users need.
+        key = self.ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._pending[key] = self._pending.get(key, 0) + 1
+
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Drop the lock once nobody else from this user is waiting on it
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
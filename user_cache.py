@@ -0,0 +1,125 @@
+from collections import OrderedDict
+import threading
+import os
+
+
+class UserCache:
+    """Bounded LRU cache of user records keyed by telegram_id.
+
+    Records are loaded lazily on first lookup and kept current by the
+    database setters, so lookups on the hot path never touch SQLite.
+
+    A load that read a row before a write to it was committed must not put
+    that old row in the cache afterwards. Every write is recorded as
+    pending for the writing thread until ``committed`` gives it a version.
+    A load is only cached if no write to the same user is pending or was
+    committed after the load started.
+    """
+
+    def __init__(self, maxsize: int = None):
+        self.maxsize = maxsize or int(os.getenv("USER_CACHE_SIZE", 10000))
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._version = 0
+        self._written = {}
+        self._pending = {}
+        self._loads = {}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, telegram_id):
+        with self._lock:
+            record = self._records.get(telegram_id)
+            if record is None:
+                self.misses += 1
+                return None
+            self._records.move_to_end(telegram_id)
+            self.hits += 1
+            return record
+
+    def _put(self, telegram_id, record) -> None:
+        self._records[telegram_id] = record
+        self._records.move_to_end(telegram_id)
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def load_started(self) -> int:
+        """Register a load about to read SQLite and return its version."""
+        with self._lock:
+            self._loads[self._version] = self._loads.get(self._version, 0) + 1
+            return self._version
+
+    def loaded(self, telegram_id, record, started: int) -> None:
+        """Cache a record read by a load, unless a write to it raced the read."""
+        with self._lock:
+            self._loads[started] -= 1
+            if not self._loads[started]:
+                del self._loads[started]
+
+            # None marks a write that is not committed yet
+            written = self._written.get(telegram_id, started)
+            if record is not None and written is not None and written <= started:
+                self._put(telegram_id, record)
+
+    def write(self, telegram_id, record=None, **fields) -> None:
+        """Record a write by this thread and apply it to the cache.
+
+        ``record`` replaces the cached record, otherwise the changed
+        ``fields`` are applied to it if there is one.
+        """
+        with self._lock:
+            self._written[telegram_id] = None
+            self._pending.setdefault(threading.get_ident(), set()).add(telegram_id)
+
+            if record is not None:
+                self._put(telegram_id, record)
+                return
+            cached = self._records.get(telegram_id)
+            if cached is not None:
+                self._records[telegram_id] = cached._replace(**fields)
+
+    def committed(self) -> None:
+        """Mark the writes this thread made as committed."""
+        with self._lock:
+            self._finish_writes()
+
+    def rolled_back(self) -> None:
+        """Drop the records this thread changed in a transaction that failed."""
+        with self._lock:
+            for telegram_id in self._finish_writes():
+                self._records.pop(telegram_id, None)
+
+    def _finish_writes(self) -> set:
+        pending = self._pending.pop(threading.get_ident(), set())
+        self._version += 1
+        for telegram_id in pending:
+            self._written[telegram_id] = self._version
+
+        # Versions older than every running load can no longer reject one
+        oldest = min(self._loads, default=self._version)
+        self._written = {
+            telegram_id: version
+            for telegram_id, version in self._written.items()
+            if version is None or version > oldest
+        }
+        return pending
+
+    def invalidate(self, telegram_id) -> None:
+        with self._lock:
+            self._records.pop(telegram_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._records),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
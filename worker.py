@@ -0,0 +1,172 @@
+from bisect import bisect
+from loguru import logger
+from bot import BankBot
+from scheduler import PollScheduler
+import database as db
+import hashlib
+import asyncio
+import socket
+import signal
+import time
+import os
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Consistent hash ring mapping telegram_ids to worker ids.
+
+    Each worker is placed on the ring ``replicas`` times, so users spread
+    evenly, and when a worker joins or leaves only the users next to its
+    points move to another worker.
+    """
+
+    def __init__(self, workers, replicas: int = 64):
+        self.workers = tuple(sorted(workers))
+        self._points = sorted(
+            (_hash(f"{worker}#{i}"), worker)
+            for worker in self.workers
+            for i in range(replicas)
+        )
+        self._keys = [point for point, _ in self._points]
+
+    def owner(self, telegram_id):
+        if not self._points:
+            return None
+        index = bisect(self._keys, _hash(str(telegram_id))) % len(self._points)
+        return self._points[index][1]
+
+
+class PollWorker:
+    """Polls the share of notification subscribers this process owns.
+
+    Every worker keeps a lease in the ``poll_workers`` table by renewing its
+    heartbeat. The workers with a live lease form the hash ring, and each
+    one schedules only the subscribers the ring assigns to it. A worker
+    whose lease runs out is dropped from the ring on the next sync, and its
+    users move to the remaining workers.
+    """
+
+    def __init__(
+        self,
+        bank: BankBot,
+        worker_id: str = None,
+        lease_ttl: float = None,
+        sync_interval: float = None,
+    ):
+        self.bank = bank
+        self.worker_id = worker_id or os.getenv(
+            "WORKER_ID", f"{socket.gethostname()}:{os.getpid()}"
+        )
+        self.lease_ttl = lease_ttl or float(os.getenv("WORKER_LEASE_TTL", 30))
+        self.sync_interval = sync_interval or float(
+            os.getenv("WORKER_SYNC_INTERVAL", self.lease_ttl / 3)
+        )
+        self.ring = HashRing([])
+        self.scheduler = PollScheduler(self.poll, storage=bank.storage)
+        self._task = None
+
+    async def poll(self, telegram_id) -> float:
+        # The bot process changes tx_notify and seen_tx_ids, so read them fresh
+        db.users.invalidate(telegram_id)
+        user = await self.bank.storage.get_user(telegram_id)
+
+        if user is None or not user.tx_notify:
+            self.scheduler.remove(telegram_id, forget=True)
+            return
+
+        return await self.bank.new_tx_trigger(telegram_id)
+
+    async def start(self) -> None:
+        await self.sync()
+        self.scheduler.start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.scheduler.stop()
+        # Let the other workers take over without waiting for the lease to expire
+        await self.bank.storage.write(db.release_worker_lease, self.worker_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.exception(f"Worker {self.worker_id} failed to sync: {e}")
+
+    async def sync(self) -> None:
+        """Renew the lease, then adopt or release users after membership changes."""
+        storage = self.bank.storage
+        now = time.time()
+
+        await storage.write(db.renew_worker_lease, self.worker_id, now)
+        await storage.write(db.expire_worker_leases, now - self.lease_ttl)
+        workers = await storage.read(db.get_live_workers, now - self.lease_ttl)
+
+        if tuple(workers) != self.ring.workers:
+            logger.info(f"Worker {self.worker_id}: ring is now {workers}")
+            self.ring = HashRing(workers)
+
+        subscribers = await storage.read(db.get_users_to_notify)
+        owned = {
+            telegram_id
+            for telegram_id, settings in subscribers.items()
+            if settings["tx_notify"] and self.ring.owner(telegram_id) == self.worker_id
+        }
+
+        # Adopted users continue on the timetable their previous owner saved
+        added = await self.scheduler.restore(owned)
+        removed = 0
+        for telegram_id in [u for u in self.scheduler if u not in owned]:
+            self.scheduler.remove(telegram_id)
+            removed += 1
+
+        if added or removed:
+            logger.info(
+                f"Worker {self.worker_id}: +{added} -{removed} users, {len(self.scheduler)} owned"
+            )
+
+
+async def run_worker() -> None:
+    bank = BankBot(os.getenv("BOT_TOKEN"))
+    await asyncio.get_running_loop().run_in_executor(None, bank.setup)
+
+    # The application is only used to send notifications, never to poll updates
+    application = bank.build_application()
+    await application.initialize()
+    await bank.storage.start()
+    await bank.api.start()
+
+    worker = PollWorker(bank)
+    await worker.start()
+    logger.success(f"Poll worker {worker.worker_id} started")
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+
+    try:
+        await stopped.wait()
+    finally:
+        await worker.stop()
+        await application.shutdown()
+        await bank.api.close()
+        bank.sdk.shutdown()
+        await bank.storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())